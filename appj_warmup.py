@@ -17,12 +17,82 @@
 ## import 3rd party packages
 import sys
 sys.dont_write_bytecode = True
-import time
-import serial
+import asyncio
 
 ## import user functions
 import utils.arduino as ard
 
+async def poll_arduino(arduino, t_poll=1.0):
+    '''
+    coroutine to periodically log the embedded measurements from the Arduino
+    while the plasma jet warms up. waiting on the serial connection releases the
+    event loop so that other tasks may run in the meantime
+
+    Inputs:
+    arduino     ArduinoProtocol instance for the Arduino connection
+    t_poll      time (in seconds) to wait between measurements
+    '''
+    while True:
+        try:
+            await arduino.get_measurement()
+        except asyncio.TimeoutError:
+            print("WARNING: no measurement received from the Arduino!")
+        await asyncio.sleep(t_poll)
+
+async def countdown(t_total=60*15, t_report=60*5):
+    '''
+    coroutine that waits for the warm-up period; messages with the time
+    remaining are scheduled on the event loop every t_report seconds
+
+    Inputs:
+    t_total     total warm-up time in seconds
+    t_report    time between progress messages in seconds
+    '''
+    loop = asyncio.get_running_loop()
+    print(f"Waiting {t_total//60} minutes to warm up the plasma jet...\n")
+    for t in range(t_report, t_total, t_report):
+        loop.call_later(t, print, f"{(t_total-t)//60} minutes left...")
+    await asyncio.sleep(t_total)
+    print(f"{t_total//60} minutes have passed!")
+
+async def warmup(arduino, t_total=60*15, t_poll=1.0):
+    '''
+    coroutine to run the warm-up timer and the Arduino monitoring concurrently;
+    monitoring is stopped once the warm-up period has elapsed
+    '''
+    poll_task = asyncio.create_task(poll_arduino(arduino, t_poll=t_poll))
+    await countdown(t_total=t_total)
+    poll_task.cancel()
+    try:
+        await poll_task
+    except asyncio.CancelledError:
+        pass
+
+async def main(arduinoAddress, powerIn, flowIn, dutyCycleIn):
+    '''
+    coroutine to start up and warm up the APPJ
+    '''
+    loop = asyncio.get_running_loop()
+    arduino = await ard.openArduinoAsync(arduinoAddress, baudrate=38400)
+
+    # send startup inputs
+    await asyncio.sleep(2)
+    arduino.send_inputs(powerIn, flowIn, dutyCycleIn)
+    await asyncio.sleep(2)
+    await loop.run_in_executor(None, input, "Ensure plasma has ignited and press Return to begin.\n")
+
+    # let APPJ run for a bit
+    await asyncio.sleep(2)
+    arduino.send_inputs(2.0, 2.0, dutyCycleIn)
+    await asyncio.sleep(2)
+
+    # wait for the plasma jet to warm up while logging the embedded measurements
+    await warmup(arduino)
+
+    arduino.send_inputs(0.0, 0.0, dutyCycleIn)
+    await asyncio.sleep(0.2)
+    arduino.close()
+
 ################################################################################
 ## Startup/prepare APPJ
 ################################################################################
@@ -37,27 +107,5 @@ if __name__=="__main__":
     # Arduino
     arduinoAddress = ard.getArduinoAddress(os="ubuntu")
     print("Arduino Address:", arduinoAddress)
-    arduinoPI = serial.Serial(arduinoAddress, baudrate=38400, timeout=1)
-    s = time.time()
 
-    # send startup inputs
-    time.sleep(2)
-    ard.sendInputsArduino(arduinoPI, powerIn, flowIn, dutyCycleIn, arduinoAddress)
-    time.sleep(2)
-    input("Ensure plasma has ignited and press Return to begin.\n")
-
-    # let APPJ run for a bit
-    time.sleep(2)
-    ard.sendInputsArduino(arduinoPI, 2.0, 2.0, dutyCycleIn, arduinoAddress)
-    ard.sendInputsArduino(arduinoPI, 2.0, 2.0, dutyCycleIn, arduinoAddress)
-    time.sleep(2)
-
-    print("Waiting 15 minutes to warm up the plasma jet...\n")
-    time.sleep(60*5)
-    print("10 minutes left...")
-    time.sleep(60*5)
-    print("5 minutes left...")
-    time.sleep(60*5)
-    print("15 minutes have passed!")
-
-    ard.sendInputsArduino(arduinoPI, 0.0, 0.0, dutyCycleIn, arduinoAddress)
+    asyncio.run(main(arduinoAddress, powerIn, flowIn, dutyCycleIn))
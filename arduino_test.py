@@ -1,13 +1,23 @@
+import os
 import serial
 import time
 import numpy as np
 
 import utils.arduino as ard_utils
 
+# pin this process to one core and run it with real-time (FIFO) priority to
+# reduce scheduler jitter in the serial I/O; this requires root privileges (or
+# CAP_SYS_NICE) and is only available on Linux
+try:
+    os.sched_setaffinity(0, {os.cpu_count()-1})
+    os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+except (AttributeError, OSError) as e:
+    print(f"WARNING: could not set real-time priority ({e}), continuing with default scheduling.")
+
 # Arduino
 arduinoAddress = ard_utils.getArduinoAddress(os="ubuntu")
 print("Arduino Address: ", arduinoAddress)
-arduinoPI = serial.Serial(arduinoAddress, baudrate=38400, timeout=1)
+arduinoPI = ard_utils.BufferedArduino(serial.Serial(arduinoAddress, baudrate=38400, timeout=1))
 
 print("Testing serial read from Arduino...\n")
 print("The output should consist of a comma-separated line of values that do not change values with the exception of the first and last values.")
@@ -22,7 +32,8 @@ ard_utils.sendInputsArduino(arduinoPI, 1.5, 1.5, 100.0, arduinoAddress)
 rand_power = (5.5-1.5) * np.random.random_sample(size=(20,)) + 1.5
 rand_flow = (8.5-1.5) * np.random.random_sample(size=(20,)) + 1.5
 
-for i in range(20):
-    ard_utils.sendControlledInputsArduino(arduinoPI, rand_power[i], rand_flow[i], arduinoAddress)
-    out = ard_utils.getMeasArduino(arduinoPI)
+schedule = list(zip(rand_power.tolist(), rand_flow.tolist()))
+
+for p, q in schedule:
+    out = ard_utils.send_and_measure(arduinoPI, p, q)
     time.sleep(0.5)
@@ -1,4 +1,38 @@
 import argparse
+import functools
+import numpy as np
+
+################################################################################
+## Arguments shared by the argument parsers of all experiment types
+################################################################################
+def add_common_args(parser, dist_treat, int_time, ts):
+    """
+    function to add the arguments shared by all experiment types (separation
+    distance, spectrometer integration time and sampling time) to a parser with
+    the given default values
+    """
+    parser.add_argument(
+        "-d",
+        "--dist_treat",
+        type=float,
+        default=dist_treat,
+        help="The jet-to-substrate distance in millimeters.",
+    )
+    parser.add_argument(
+        "-it",
+        "--int_time_treat",
+        type=float,
+        default=int_time,
+        help="The integration time for the spectrometer in microseconds.",
+    )
+    parser.add_argument(
+        "-ts",
+        "--sampling_time",
+        type=float,
+        default=ts,
+        help="The sampling time to take measurements in seconds.",
+    )
+    return parser
 
 ################################################################################
 ## Set up argument parser for multistep open loop data collection
@@ -19,93 +53,114 @@ ts_default = 1.0  # sampling time to take measurements in seconds
 surface_default = "copper tape on glass" # surface material
 # NOTE: sampling time should be greater than integration time by roughly double
 
-parser = argparse.ArgumentParser(description="Experiment Settings")
-parser.add_argument(
-    "-f",
-    "--file_label",
-    type=str,
-    default=data_file_label_default,
-    help="The extra string to append to the save file.",
-)
-parser.add_argument(
-    "-s",
-    "--step_length",
-    type=float,
-    default=step_length_default,
-    help="The the length of a step change in seconds.",
-)
-parser.add_argument(
-    "-px",
-    "--P_max",
-    type=float,
-    default=P_max_default,
-    help="The maximum power setting for the treatment in Watts.",
-)
-parser.add_argument(
-    "-pn",
-    "--P_min",
-    type=float,
-    default=P_min_default,
-    help="The minimum power setting for the treatment in Watts.",
-)
-parser.add_argument(
-    "-ps",
-    "--P_step",
-    type=float,
-    default=P_step_default,
-    help="The step size of the power setting for the treatment in Watts.",
-)
-parser.add_argument(
-    "-qx",
-    "--q_max",
-    type=float,
-    default=q_max_default,
-    help="The maximum flow rate setting for the treatment in SLM.",
-)
-parser.add_argument(
-    "-qn",
-    "--q_min",
-    type=float,
-    default=q_min_default,
-    help="The minimum flow rate setting for the treatment in SLM.",
-)
-parser.add_argument(
-    "-qs",
-    "--q_step",
-    type=float,
-    default=q_step_default,
-    help="The step size of the flow rate setting for the treatment in SLM.",
-)
-parser.add_argument(
-    "-d",
-    "--dist_treat",
-    type=float,
-    default=dist_treat_default,
-    help="The jet-to-substrate distance in millimeters.",
-)
-parser.add_argument(
-    "-it",
-    "--int_time_treat",
-    type=float,
-    default=int_time_default,
-    help="The integration time for the spectrometer in microseconds.",
-)
-parser.add_argument(
-    "-ts",
-    "--sampling_time",
-    type=float,
-    default=ts_default,
-    help="The sampling time to take measurements in seconds.",
-)
-parser.add_argument(
-    "-m",
-    "--surface_material",
-    type=str,
-    default=surface_default,
-    help="The surface material in which the plasma is impinging on. Assumed to be placed on top of the metal base plate.",
-)
+@functools.cache
+def get_multistep_parser():
+    """
+    function to build the argument parser for multistep open loop data
+    collection; the parser is only constructed the first time it is requested
+    """
+    parser = argparse.ArgumentParser(description="Experiment Settings")
+    parser.add_argument(
+        "-f",
+        "--file_label",
+        type=str,
+        default=data_file_label_default,
+        help="The extra string to append to the save file.",
+    )
+    parser.add_argument(
+        "-s",
+        "--step_length",
+        type=float,
+        default=step_length_default,
+        help="The the length of a step change in seconds.",
+    )
+    parser.add_argument(
+        "-px",
+        "--P_max",
+        type=float,
+        default=P_max_default,
+        help="The maximum power setting for the treatment in Watts.",
+    )
+    parser.add_argument(
+        "-pn",
+        "--P_min",
+        type=float,
+        default=P_min_default,
+        help="The minimum power setting for the treatment in Watts.",
+    )
+    parser.add_argument(
+        "-ps",
+        "--P_step",
+        type=float,
+        default=P_step_default,
+        help="The step size of the power setting for the treatment in Watts.",
+    )
+    parser.add_argument(
+        "-qx",
+        "--q_max",
+        type=float,
+        default=q_max_default,
+        help="The maximum flow rate setting for the treatment in SLM.",
+    )
+    parser.add_argument(
+        "-qn",
+        "--q_min",
+        type=float,
+        default=q_min_default,
+        help="The minimum flow rate setting for the treatment in SLM.",
+    )
+    parser.add_argument(
+        "-qs",
+        "--q_step",
+        type=float,
+        default=q_step_default,
+        help="The step size of the flow rate setting for the treatment in SLM.",
+    )
+    add_common_args(
+        parser,
+        dist_treat=dist_treat_default,
+        int_time=int_time_default,
+        ts=ts_default,
+    )
+    parser.add_argument(
+        "-m",
+        "--surface_material",
+        type=str,
+        default=surface_default,
+        help="The surface material in which the plasma is impinging on. Assumed to be placed on top of the metal base plate.",
+    )
+    return parser
 
-multistep_parser = parser
+def grid(start, stop, step):
+    """
+    function to get the evenly spaced settings start, start+step, ... that are
+    less than stop (as np.arange). The number of settings is rounded before
+    taking the ceiling, so floating point error in (stop-start)/step cannot add
+    a setting at (or just below) stop.
+    """
+    n = max(int(np.ceil(np.round((stop-start)/step, 6))), 0)
+    return np.linspace(start, start+(n-1)*step, n)
+
+
+def materialize_sweep(args, seed=0):
+    """
+    function to build the grid of power and flow rate settings of a multistep
+    experiment from the parsed arguments. The power and flow rate settings are
+    each shuffled (with a fixed seed) and the resulting sweep is attached to
+    args as args.sweep, an array whose columns are (power, flow rate).
+    """
+    uvec1 = grid(args.P_min, args.P_max, args.P_step)  # for power
+    uvec2 = grid(args.q_min, args.q_max, args.q_step)  # for flow rate
+    # fill the grid in place by broadcasting (same ordering as np.meshgrid)
+    sweep = np.empty((len(uvec2), len(uvec1), 2))
+    sweep[:, :, 0] = uvec1[None, :]
+    sweep[:, :, 1] = uvec2[:, None]
+    sweep = sweep.reshape(-1, 2)
+    rng = np.random.default_rng(seed)
+    rng.shuffle(sweep[:, 0])
+    rng.shuffle(sweep[:, 1])
+    args.sweep = sweep
+    return args
 
 ################################################################################
 ## Set up argument parser for single sample open loop data collection
@@ -116,28 +171,33 @@ sample_num_default = 0      # sample number for treatment
 time_treat_default = 60.0   # time to run experiment in seconds
 P_treat_default = 0.0       # power setting for the treatment in Watts
 q_treat_default = 0.0       # flow setting for the treatment in standard liters per minute (SLM)
-dist_treat_default = 9.0    # jet-to-substrate distance in mm
-int_time_default = 12000*9  # integration time for spectrometer measurement in microseconds
-ts_default = 0.5            # sampling time to take measurements in seconds
+sample_dist_treat_default = 9.0    # jet-to-substrate distance in mm
+sample_int_time_default = 12000*9  # integration time for spectrometer measurement in microseconds
+sample_ts_default = 0.5            # sampling time to take measurements in seconds
 # NOTE: sampling time should be greater than integration time by roughly double
 
 ################################################################################
 ## Set up argument parser
 ################################################################################
-parser = argparse.ArgumentParser(description='Experiment Settings')
-parser.add_argument('-n', '--sample_num', type=int, default=sample_num_default,
-                    help='The sample number for the test treatments.')
-parser.add_argument('-t', '--time_treat', type=float, default=time_treat_default,
-                    help='The treatment time desired in seconds.')
-parser.add_argument('-p', '--P_treat', type=float, default=P_treat_default,
-                    help='The power setting for the treatment in Watts.')
-parser.add_argument('-q', '--q_treat', type=float, default=q_treat_default,
-                    help='The flow rate setting for the treatment in SLM.')
-parser.add_argument('-d', '--dist_treat', type=float, default=dist_treat_default,
-                    help='The jet-to-substrate distance in millimeters.')
-parser.add_argument('-it', '--int_time_treat', type=float, default=int_time_default,
-                    help='The integration time for the spectrometer in microseconds.')
-parser.add_argument('-ts', '--sampling_time', type=float, default=ts_default,
-                    help='The sampling time to take measurements in seconds.')
-
-single_sample_parser = parser
\ No newline at end of file
+@functools.cache
+def get_single_sample_parser():
+    """
+    function to build the argument parser for single sample open loop data
+    collection; the parser is only constructed the first time it is requested
+    """
+    parser = argparse.ArgumentParser(description='Experiment Settings')
+    parser.add_argument('-n', '--sample_num', type=int, default=sample_num_default,
+                        help='The sample number for the test treatments.')
+    parser.add_argument('-t', '--time_treat', type=float, default=time_treat_default,
+                        help='The treatment time desired in seconds.')
+    parser.add_argument('-p', '--P_treat', type=float, default=P_treat_default,
+                        help='The power setting for the treatment in Watts.')
+    parser.add_argument('-q', '--q_treat', type=float, default=q_treat_default,
+                        help='The flow rate setting for the treatment in SLM.')
+    add_common_args(
+        parser,
+        dist_treat=sample_dist_treat_default,
+        int_time=sample_int_time_default,
+        ts=sample_ts_default,
+    )
+    return parser
@@ -1,12 +1,17 @@
 from fastapi import FastAPI
 
+app = FastAPI()
+
+@app.get("/")
+async def root():
+    return {"message": "Hello World!"}
+
+@app.get("/troubleshooting")
+async def run_appj():
+    return {"message": "test"}
+
 if __name__ == "__main__":
-    app = FastAPI()
-
-    @app.get("/")
-    async def root():
-        return {"message": "Hello World!"}
-    
-    @app.get("/troubleshooting")
-    async def run_appj():
-        return {"message": "test"}
\ No newline at end of file
+    import uvicorn
+
+    # "auto" uses uvloop and httptools when they are installed
+    uvicorn.run("main:app", loop="auto", http="auto")
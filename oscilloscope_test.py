@@ -191,7 +191,7 @@ while time.time() - tStart <= loopTime:
     colors = ["tab:blue", "tab:red", "tab:green", "tab:yellow"]
     lines = []
     for i in range(n_channels):
-        ch_data = np.asarray(ch_datas[i]["data"])
+        ch_data = ch_datas[i]
         if np.any(ch_data > 1e3):
             if not twin_ax:
                 ax3 = ax2.twinx()
@@ -1,6 +1,8 @@
 from picosdk.ps2000a import ps2000a as ps
 import ctypes
 
+from utils.oscilloscope import Channel, ChannelCfg
+
 ################################################################################
 # USER OPTIONS (you may change these)
 ################################################################################
@@ -15,52 +17,49 @@ timebase = 127  # 2 corresponds to 4 ns; 127 # 127 corresponds to 1 us
 
 # set the channels to read from oscilloscope
 # up to four channels may be set: A, B, C, D
-# you should pass a list of dictionaries for the settings of each channel. The
-# dictionary for a channel should contain the following keys:
-#   "name": the name of the channel, specified either as a single letter
-#           ("A", "B", "C", and/or "D") or with the format "CH_A"
-#           (i.e., "CH_A", "CH_B", "CH_C", "CH_D"); this is the minimum required
-#           for these dictionaries; if only the name is provided, then pre-defined
-#           default settings will be used
-#   "enable_status": 0 or 1 indicating whether or not to enable this channel;
-#           default: 1
-#   "coupling_type": AC or DC, specified using the Enums provided in the ps2000a
-#           package; default: ps.PS2000A_COUPLING['PS2000A_DC']
-#   "range": the range of the signal, spcified using the Enums provided in the
-#           ps2000a package; default ps.PS2000A_RANGE['PS2000_2V']
-#   "analog_offset": the offset for the analog reading; default: 0.0
-channelA = {
-    "name": "A",
-    "enable_status": 1,
-    "coupling_type": ps.PS2000A_COUPLING["PS2000A_DC"],
-    "range": ps.PS2000A_RANGE["PS2000A_10V"],
-    "analog_offset": 0.0,
-}
-
-channelB = {
-    "name": "B",
-    "enable_status": 1,
-    "coupling_type": ps.PS2000A_COUPLING["PS2000A_DC"],
-    "range": ps.PS2000A_RANGE["PS2000A_20MV"],
-    "analog_offset": 0.0,
-}
-channelC = {
-    "name": "C",
-    "enable_status": 1,
-    "coupling_type": ps.PS2000A_COUPLING["PS2000A_DC"],
-    "range": ps.PS2000A_RANGE["PS2000A_10V"],
-    "analog_offset": 0.0,
-}
-channelD = {
-    "name": "D",
-    "enable_status": 1,
-    "coupling_type": ps.PS2000A_COUPLING["PS2000A_DC"],
-    "range": ps.PS2000A_RANGE["PS2000A_5V"],
-    "analog_offset": 0.0,
-}
+# the settings of each channel are given as a ChannelCfg structure (see
+# utils/oscilloscope.py) and the channels are passed to the oscilloscope as an
+# array of these structures. The fields of ChannelCfg are, in order:
+#   channel: the channel, specified using the Channel Enum in utils/oscilloscope.py
+#           (i.e., Channel.CH_A.value, Channel.CH_B.value, etc.)
+#   enabled: 0 or 1 indicating whether or not to enable this channel
+#   coupling: AC or DC, specified using the Enums provided in the ps2000a
+#           package, e.g., ps.PS2000A_COUPLING['PS2000A_DC']
+#   range: the range of the signal, spcified using the Enums provided in the
+#           ps2000a package, e.g., ps.PS2000A_RANGE['PS2000_2V']
+#   offset: the offset for the analog reading
+# (a list of dictionaries, as described in oscilloscope_test.py, may also be used)
+channelA = ChannelCfg(
+    Channel.CH_A.value,
+    1,
+    ps.PS2000A_COUPLING["PS2000A_DC"],
+    ps.PS2000A_RANGE["PS2000A_10V"],
+    0.0,
+)
+channelB = ChannelCfg(
+    Channel.CH_B.value,
+    1,
+    ps.PS2000A_COUPLING["PS2000A_DC"],
+    ps.PS2000A_RANGE["PS2000A_20MV"],
+    0.0,
+)
+channelC = ChannelCfg(
+    Channel.CH_C.value,
+    1,
+    ps.PS2000A_COUPLING["PS2000A_DC"],
+    ps.PS2000A_RANGE["PS2000A_10V"],
+    0.0,
+)
+channelD = ChannelCfg(
+    Channel.CH_D.value,
+    1,
+    ps.PS2000A_COUPLING["PS2000A_DC"],
+    ps.PS2000A_RANGE["PS2000A_5V"],
+    0.0,
+)
 
-channels = [channelA, channelB, channelC]
-# channels = [channelA, channelB, channelC, channelD]
+channels = (ChannelCfg * 3)(channelA, channelB, channelC)
+# channels = (ChannelCfg * 4)(channelA, channelB, channelC, channelD)
 # status = osc.set_channels(channels)
 # print(status)
 
@@ -1,3 +1,4 @@
+import os
 import h5py
 import numpy as np
 import matplotlib.pyplot as plt
@@ -7,12 +8,88 @@ data_folder = "/home/mesbahappj/Desktop/PlasmaBOChemistry-ExperimentalData/2024_
 
 img_folder = "/OL_data_0/thermal_images"
 Niter = 1000
-plt.ion()
-for i in range(Niter):
-    with h5py.File(data_folder+img_folder+f"/iter{i}.h5", 'r') as f:
-        img_data = np.asarray(f['image'])
-
-    plt.imshow(img_data)
-    plt.title(f"Iteration {i}")
-    plt.pause(0.1)
-    plt.clf()
+
+
+def map_dataset(dset):
+    '''
+    function to map an HDF5 dataset directly from the file into memory, bypassing
+    the HDF5 read path. This only applies to contiguous datasets without filters,
+    i.e., the uncompressed per-iteration files (iter{i}.h5) of older data sets;
+    the single thermal_images.h5 file saved now is chunked and compressed, and is
+    read through h5py. Returns None if the dataset cannot be mapped.
+    '''
+    # only contiguous datasets have a single offset (and they cannot be filtered)
+    if dset.chunks is not None:
+        return None
+    offset = dset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dset.file.filename, dtype=dset.dtype, mode='r', offset=offset, shape=dset.shape)
+
+
+def iter_images(folder, Niter):
+    '''
+    generator that yields the iteration number and thermal image data saved in
+    the given folder
+    '''
+    if os.path.exists(folder+".h5"):
+        # images saved to a single (chunked, compressed) file; open the file
+        # once and read one image per iteration, with a chunk cache large
+        # enough to hold the chunk (batch of images) being read
+        with h5py.File(folder+".h5", 'r', rdcc_nbytes=64*1024*1024) as f:
+            images = f['images']
+            for i in range(min(Niter, images.shape[0])):
+                yield i, images[i]
+    else:
+        # older data sets saved one (uncompressed) file per iteration, which is
+        # mapped directly if possible
+        for i in range(Niter):
+            with h5py.File(folder+f"/iter{i}.h5", 'r', rdcc_nbytes=0) as f:
+                img_data = map_dataset(f['image'])
+                if img_data is None:
+                    img_data = np.asarray(f['image'])
+            yield i, img_data
+
+
+frames = iter_images(data_folder+img_folder, Niter)
+i, img_data = next(frames)
+
+# create the image and title once; frames are then updated by a timer on the
+# GUI event loop, blitting only the image and title over a cached background
+fig, ax = plt.subplots()
+# images are saved as a single (grayscale) channel, shown on the fixed 8-bit
+# range so that all frames share one color scale (set_data does not rescale);
+# older data sets saved RGB images, for which the colormap/range is ignored
+im = ax.imshow(img_data, cmap="gray", vmin=0, vmax=255, animated=True)
+title = ax.set_title(f"Iteration {i}", animated=True)
+bg = None
+
+
+def on_draw(event):
+    # cache the static background after every full redraw (e.g., on resize)
+    global bg
+    bg = fig.canvas.copy_from_bbox(fig.bbox)
+    ax.draw_artist(im)
+    ax.draw_artist(title)
+
+
+def update_frame():
+    try:
+        i, img_data = next(frames)
+    except StopIteration:
+        timer.stop()
+        return
+    im.set_data(img_data)
+    title.set_text(f"Iteration {i}")
+    if bg is not None:
+        fig.canvas.restore_region(bg)
+        ax.draw_artist(im)
+        ax.draw_artist(title)
+        fig.canvas.blit(fig.bbox)
+
+
+fig.canvas.mpl_connect("draw_event", on_draw)
+timer = fig.canvas.new_timer(interval=100)
+timer.add_callback(update_frame)
+timer.start()
+plt.show()
@@ -1,12 +1,44 @@
 # python script to save segregated data files 
-# in the event that a JSON file was saved but 
+# in the event that a backup file was saved but 
 # the script errored out during segregated save
 
 from utils.experiments import *
 from utils.run_options import RunOpts
-import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 plot_data = True
+
+
+def decimate(y, target=2000):
+    '''
+    function to downsample a data series to roughly target points for plotting;
+    the series is split into buckets and the min and max of each bucket are
+    kept (in order), so that short spikes/transients (e.g., of the power or the
+    temperature) still show in the plots
+
+    Outputs:
+    x       indices of the points kept
+    y       the points kept
+    '''
+    y = np.asarray(y)
+    n = len(y)
+    size = max(1, 2*n//target)
+    if size == 1:
+        return np.arange(n), y
+    n_full = n//size*size
+    buckets = y[:n_full].reshape(-1, size)
+    starts = np.arange(0, n_full, size)
+    # the (short) remainder after the last full bucket is kept as is
+    idx = np.unique(np.concatenate([
+        starts + buckets.argmin(axis=1),
+        starts + buckets.argmax(axis=1),
+        np.arange(n_full, n),
+    ]))
+    return idx, y[idx]
+
 # save_folder = "/home/mesbahappj/Desktop/PlasmaBOChemistry-ExperimentalData/2024_02_01_11h04m59s_OL_multistep_SHORT"
 # save_folder = "/home/mesbahappj/Desktop/PlasmaBOChemistry-ExperimentalData/2024_02_01_13h14m12s_OL_multistep_LONG"
 # save_folder = "/home/mesbahappj/Desktop/PlasmaBOChemistry-ExperimentalData/2024_02_05_18h20m01s_OL_multistep_SHORT"
@@ -30,8 +62,20 @@ runOpts.saveEntireImage = True
 runOpts.tSampling = 0.5  # set the sampling time of the measurements
 
 # grab exp_data saved in backup
-with open(save_folder+"/Backup/OL_data_0.json") as f:
-    exp_data = json.load(f)
+if os.path.exists(save_folder+"/Backup/OL_data_0.h5"):
+    exp_data = exp_data_load_backup(save_folder+"/Backup/", "OL_data_0")
+else:
+    # older data sets saved the backup as a single JSON file (orjson parses the
+    # large numeric arrays much faster than the standard library, if it is
+    # installed)
+    with open(save_folder+"/Backup/OL_data_0.json", "rb") as f:
+        if orjson is not None:
+            exp_data = orjson.loads(f.read())
+        else:
+            exp_data = json.load(f)
+# convert the input/output data to arrays once for saving and plotting
+for key in ["Tsave", "Isave", "Psave", "qSave"]:
+    exp_data[key] = np.asarray(exp_data[key])
 
 # save
 exp_data_saver(exp_data, save_folder+"/", "OL_data_0", runOpts)
@@ -42,13 +86,13 @@ if plot_data:
     import matplotlib.pyplot as plt
 
     fig, (ax1, ax2, ax3, ax4) = plt.subplots(4, 1, figsize=(8, 8), dpi=150)
-    ax1.plot(exp_data["Tsave"][30:])
+    ax1.plot(*decimate(exp_data["Tsave"][30:]))
     ax1.set_ylabel("Maximum Surface\nTemperature ($^\circ$C)")
-    ax2.plot(exp_data["Isave"][30:])
+    ax2.plot(*decimate(exp_data["Isave"][30:]))
     ax2.set_ylabel("Total Optical\nEmission Intensity\n(arb. units)")
-    ax3.plot(exp_data["Psave"][30:])
+    ax3.plot(*decimate(exp_data["Psave"][30:]))
     ax3.set_ylabel("Power (W)")
-    ax4.plot(exp_data["qSave"][30:])
+    ax4.plot(*decimate(exp_data["qSave"][30:]))
     ax4.set_ylabel("Carrier Gas\nFlow Rate (SLM)")
     ax4.set_xlabel("Time Step")
     plt.tight_layout()
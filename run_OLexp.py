@@ -20,31 +20,47 @@ import sys
 
 sys.dont_write_bytecode = True
 import numpy as np
-from seabreeze.spectrometers import Spectrometer, list_devices
 import time
 import os
-import serial
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import argparse
 
-## import user functions
-from utils.run_options import RunOpts
-import utils.thermal_camera as tc_utils
-import utils.async_measurement as ameas
-import utils.arduino as ard_utils
-from utils.oscilloscope import Oscilloscope
-from utils.experiments import Experiment
-
-## import picoscope settings
-from picoscope_setup import *
+if os.name == "nt":
+    # proactor event loop for subprocess' pipes on Windows
+    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+else:
+    # use uvloop for the measurement event loop, if it is installed
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
 
 ## import arg_parse parser
-from arg_parse import multistep_parser as parser
+from arg_parse import get_multistep_parser, materialize_sweep
 
 plot_data = True  # [True/False] whether or not to plot the (2-input, 2-output) data after an experiment
+if plot_data:
+    # import before the experiment so shutdown is not delayed by the import;
+    # without a display, use the non-interactive Agg backend (the figure is
+    # saved either way) to skip initializing a GUI toolkit
+    import matplotlib
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+parser = get_multistep_parser()
+args = materialize_sweep(parser.parse_args())
+
+## import user functions (after parsing the arguments, so that --help returns
+## without loading the device drivers)
+import utils.async_measurement as ameas
+import utils.arduino as ard_utils
+import utils.experiment_runtime as runtime
+from utils.experiments import Experiment
 
-args = parser.parse_args()
 file_label = args.file_label
 step_length = args.step_length
 P_max = args.P_max
@@ -75,16 +91,26 @@ settings_str = (
 )
 print(settings_str)
 
-if ts < 2 * int_time_treat * 1e-6:
+# compare in whole microseconds to avoid floating point roundoff
+if round(ts * 1e6) < 2 * int_time_treat:
     print(
         "Integration time too large! Please modify the integration time and/or the sampling time such that the sampling time is greater than double the integration time."
     )
     exit(1)
 
+# find the Arduino first, since this may ask for user input, and then open the
+# devices in the background while the settings are confirmed
+arduinoAddress = ard_utils.getArduinoAddress(os="ubuntu")
+executor = ThreadPoolExecutor(max_workers=1)
+devices_future = executor.submit(runtime.setup_devices, int_time_treat, arduinoAddress)
+
 cfm = input("Confirm these are correct [Y/n]: ")
 if cfm in ["Y", "y"]:
     pass
 else:
+    # close the devices that were opened in the background before quitting
+    runtime.close_devices(devices_future.result())
+    executor.shutdown()
     quit()
 
 ################################################################################
@@ -97,17 +123,7 @@ print("Timestamp for save files: ", timeStamp)
 Nrep = 1
 
 # configure run options
-runOpts = RunOpts()
-runOpts.collectData = True  # option to collect two-input, two-output data (power, flow rate); (max surface temperature, total intensity)
-runOpts.collectEntireSpectra = True  # option to collect full intensity spectra
-runOpts.collectOscMeas = True  # option to collect oscilloscope measurements (using PicoScope)
-runOpts.collectSpatialTemp = False  # option to collect spatial temperature (defined as temperature from 12 pixels away from max in the four cardinal directions)
-# save options; correspond to the collection (two-input, two-output data is always saved)
-runOpts.saveSpectra = True
-runOpts.saveOscMeas = True
-runOpts.saveSpatialTemp = False  # limited functionality
-runOpts.saveEntireImage = True
-runOpts.tSampling = ts  # set the sampling time of the measurements
+runOpts = runtime.get_run_options(ts)
 
 ## Set startup values
 dutyCycleIn = 100
@@ -115,112 +131,71 @@ powerIn = P_min
 flowIn = q_min
 
 # set save location
-directory = os.getcwd()
-split_cwd = directory.split("/")
-repo = split_cwd[-1]
-saveDir = directory + f"/../{repo}-ExperimentalData/" + timeStamp + f"_{file_label}/"
+saveDir = runtime.get_save_dir(timeStamp, f"_{file_label}")
 print("\nData will be saved in the following directory:")
 print(saveDir)
 
 ## connect to/open connection to devices in setup
-# Arduino
-arduinoAddress = ard_utils.getArduinoAddress(os="ubuntu")
-print("Arduino Address: ", arduinoAddress)
-arduinoPI = serial.Serial(arduinoAddress, baudrate=38400, timeout=1)
-s = time.time()
-
-# Oscilloscope
-mode = "streaming"  # or "block"
-# Create an instance of the oscilloscope
-osc = Oscilloscope(
-    mode=mode,
-    single_buff_size=single_buffer_size,
-    n_buffs=n_buffers,
-    pretrigger_size=pretrigger_size,
-    posttrigger_size=posttrigger_size,
-)
-# Open the oscilloscope
-status = osc.open_device()
-print(status)
-status = osc.initialize_device(channels, buffers)
-
-# Spectrometer
-devices = list_devices()
-print(devices)
-spec = Spectrometer(devices[0])
-spec.integration_time_micros(int_time_treat)  ## change integration time (units of microseconds)
-
-# Thermal Camera
-dev, ctx = tc_utils.openThermalCamera()
-print("Devices opened/connected to sucessfully!")
-
-devices = {}
-devices["arduinoPI"] = arduinoPI
-devices["arduinoAddress"] = arduinoAddress
-devices["osc"] = osc
-devices["spec"] = spec
+devices = devices_future.result()
+executor.shutdown()
+arduinoPI = devices["arduinoPI"]
+arduinoAddress = devices["arduinoAddress"]
+osc = devices["osc"]
+spec = devices["spec"]
+s = time.perf_counter_ns()
 
 # send startup inputs
 time.sleep(2)
 ard_utils.sendInputsArduino(arduinoPI, 2.0, 2.0, dutyCycleIn, arduinoAddress)
+# initialize the measurements while the plasma is ignited
+ioloop = runtime.start_event_loop()
+warmup = runtime.start_warmup(devices, runOpts, ioloop)
 input("Ensure plasma has ignited and press Return to begin.\n")
 
 ## Startup asynchronous measurement
-if os.name == "nt":
-    ioloop = asyncio.ProactorEventLoop()  # for subprocess' pipes on Windows
-    asyncio.set_event_loop(ioloop)
-else:
-    ioloop = asyncio.get_event_loop()
-# run once to initialize measurements
-prevTime = (time.time() - s) * 1e3
-tasks, runTime = ioloop.run_until_complete(
-    ameas.async_measure(arduinoPI, osc, spec, runOpts)
-)
+# wait for the measurements to be initialized and get initial measurements
+warmup.result()
 print("measurement devices ready!")
-
-# get initial measurements
-tasks, runTime = ioloop.run_until_complete(
-    ameas.async_measure(arduinoPI, osc, spec, runOpts)
+prevTime = (time.perf_counter_ns() - s) / 1e6
+results, runTime = runtime.run_on_loop(
+    ioloop,
+    ameas.async_measure(arduinoPI, osc, spec, runOpts, devices["wavelengths"]),
 )
 if runOpts.collectData:
-    thermalCamOut = tasks[0].result()
+    thermalCamOut = results[0]
     Ts0 = thermalCamOut[0]
-    specOut = tasks[1].result()
+    specOut = results[1]
     I0 = specOut[0]
-    oscOut = tasks[2].result()
-    arduinoOut = tasks[3].result()
+    oscOut = results[2]
+    arduinoOut = results[3]
     outString = "Measured Outputs: Temperature: %.2f, Intensity: %.2f" % (Ts0, I0)
     print(outString)
 else:
     Ts0 = 37
     I0 = 100
 
-s = time.time()
+s = time.perf_counter_ns()
 
 ################################################################################
 ## Begin Experiment:
 ################################################################################
 # create input sequences
-uvec1 = np.arange(start=P_min, stop=P_max, step=P_step)  # for power
-uvec2 = np.arange(start=q_min, stop=q_max, step=q_step)  # for flow rate
-uu1, uu2 = np.meshgrid(uvec1, uvec2)
-uvec1 = uu1.reshape(-1,)
-uvec2 = uu2.reshape(-1,)
-rng = np.random.default_rng(0)
-rng.shuffle(uvec1)
-pseq = np.copy(uvec1)
+# (off, three steps at the nominal inputs, then the shuffled sweep)
+n_sweep = args.sweep.shape[0]
 p_nom = (P_max+P_min)/2
-pseq = np.insert(pseq, 0, [0.0, p_nom, p_nom, p_nom])
-rng.shuffle(uvec2)
-qseq = np.copy(uvec2)
+pseq = np.empty((n_sweep+4,))  # for power
+pseq[:4] = [0.0, p_nom, p_nom, p_nom]
+pseq[4:] = args.sweep[:, 0]
 q_nom = (q_max+q_min)/2
-qseq = np.insert(qseq, 0, [0.0, q_nom, q_nom, q_nom])
+qseq = np.empty((n_sweep+4,))  # for flow rate
+qseq[:4] = [0.0, q_nom, q_nom, q_nom]
+qseq[4:] = args.sweep[:, 1]
 print(pseq)
 print(qseq)
 n_steps = int(step_length / runOpts.tSampling)
 
-pseq = np.repeat(pseq, n_steps).reshape(-1,)
-qseq = np.repeat(qseq, n_steps).reshape(-1,)
+pseq = np.repeat(pseq, n_steps)
+qseq = np.repeat(qseq, n_steps)
 print(pseq.shape[0])
 
 Nsim = len(pseq)
@@ -234,23 +209,24 @@ with open(saveDir + "notes.txt", "a") as f:
 opt_dict = {}
 opt_dict["exp_settings"] = settings_str
 
-exp_data = exp.run_open_loop(
-    ioloop,
+exp_data = runtime.run_on_loop(ioloop, exp.async_run_open_loop(
     power_seq=pseq,
     flow_seq=qseq,
     runOpts=runOpts,
     devices=devices,
     prevTime=prevTime,
     opt_dict=opt_dict,
-)
+))
 
 # turn off plasma jet (programmatically)
 ard_utils.sendInputsArduino(arduinoPI, 0.0, 0.0, dutyCycleIn, arduinoAddress)
 arduinoPI.close()
+osc.stop_streaming_thread()
+# wait for the experimental data to be saved
+exp.wait_for_saves()
+runtime.stop_event_loop(ioloop)
 
 if plot_data:
-    import matplotlib.pyplot as plt
-
     fig, (ax1, ax2, ax3, ax4) = plt.subplots(4, 1, figsize=(8, 8), dpi=150)
 
     ax1.plot(exp_data["Tsave"][n_steps:])
@@ -263,7 +239,9 @@ if plot_data:
     ax4.set_ylabel("Carrier Gas\nFlow Rate (SLM)")
     ax4.set_xlabel("Time Step")
     plt.tight_layout()
-    plt.show()
+    fig.savefig(saveDir + "summary.png")
+    if matplotlib.get_backend().lower() != "agg":
+        plt.show()
 
 print(
     "Experiment complete!\n"
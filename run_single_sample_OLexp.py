@@ -19,30 +19,46 @@
 import sys
 sys.dont_write_bytecode = True
 import numpy as np
-from seabreeze.spectrometers import Spectrometer, list_devices
 import time
 import os
-import serial
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 
-## import user functions
-from utils.run_options import RunOpts
-import utils.thermal_camera as tc_utils
-import utils.async_measurement as ameas
-import utils.arduino as ard_utils
-from utils.oscilloscope import Oscilloscope
-from utils.experiments import Experiment
-
-## import picoscope settings
-from picoscope_setup import *
+if os.name == "nt":
+    # proactor event loop for subprocess' pipes on Windows
+    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+else:
+    # use uvloop for the measurement event loop, if it is installed
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
 
 ## import arg_parse parser
-from arg_parse import single_sample_parser as parser
+from arg_parse import get_single_sample_parser
 
 plot_data = True # [True/False] whether or not to plot the (2-input, 2-output) data after an experiment
+if plot_data:
+    # import before the experiment so shutdown is not delayed by the import;
+    # without a display, use the non-interactive Agg backend (the figure is
+    # saved either way) to skip initializing a GUI toolkit
+    import matplotlib
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
 
+parser = get_single_sample_parser()
 args = parser.parse_args()
+
+## import user functions (after parsing the arguments, so that --help returns
+## without loading the device drivers)
+import utils.async_measurement as ameas
+import utils.arduino as ard_utils
+import utils.experiment_runtime as runtime
+from utils.experiments import Experiment
+
 sample_num = args.sample_num
 time_treat = args.time_treat
 P_treat = args.P_treat
@@ -61,14 +77,24 @@ settings_str = f"The settings for this treatment are:\n"\
       f"Sampling Time (s):          {ts}\n"
 print(settings_str)
 
-if ts < 2*int_time_treat*1e-6:
+# compare in whole microseconds to avoid floating point roundoff
+if round(ts*1e6) < 2*int_time_treat:
     print("Integration time too large! Please modify the integration time and/or the sampling time such that the sampling time is greater than double the integration time.")
     exit(1)
 
+# find the Arduino first, since this may ask for user input, and then open the
+# devices in the background while the settings are confirmed
+arduinoAddress = ard_utils.getArduinoAddress(os='ubuntu')
+executor = ThreadPoolExecutor(max_workers=1)
+devices_future = executor.submit(runtime.setup_devices, int_time_treat, arduinoAddress)
+
 cfm = input("Confirm these are correct: [Y/n]\n")
 if cfm in ['Y', 'y']:
     pass
 else:
+    # close the devices that were opened in the background before quitting
+    runtime.close_devices(devices_future.result())
+    executor.shutdown()
     quit()
 
 ################################################################################
@@ -81,17 +107,7 @@ print('Timestamp for save files: ', timeStamp)
 Nrep = 1
 
 # configure run options
-runOpts = RunOpts()
-runOpts.collectData = True      # option to collect two-input, two-output data (power, flow rate); (max surface temperature, total intensity)
-runOpts.collectEntireSpectra = True # option to collect full intensity spectra
-runOpts.collectOscMeas = True # option to collect oscilloscope measurements (not functioning)
-runOpts.collectSpatialTemp = False # option to collect spatial temperature (defined as temperature from 12 pixels away from max in the four cardinal directions)
-# save options; correspond to the collection (two-input, two-output data is always saved)
-runOpts.saveSpectra = True
-runOpts.saveOscMeas = True
-runOpts.saveSpatialTemp = False # limited functionality
-runOpts.saveEntireImage = True
-runOpts.tSampling = ts # set the sampling time of the measurements
+runOpts = runtime.get_run_options(ts)
 
 ## Set startup values
 dutyCycleIn = 100
@@ -99,87 +115,50 @@ powerIn = P_treat
 flowIn = q_treat
 
 # set save location
-directory = os.getcwd()
-split_cwd = directory.split('/')
-repo = split_cwd[-1]
-saveDir = directory+f"/../{repo}-ExperimentalData/"+timeStamp+f"-Sample{sample_num}/"
+saveDir = runtime.get_save_dir(timeStamp, f"-Sample{sample_num}")
 print('\nData will be saved in the following directory:')
 print(saveDir)
 
 ## connect to/open connection to devices in setup
-# Arduino
-arduinoAddress = ard_utils.getArduinoAddress(os="ubuntu")
-print("Arduino Address: ", arduinoAddress) 
-arduinoPI = serial.Serial(arduinoAddress, baudrate=38400, timeout=1)
-s = time.time()
-
-# Oscilloscope
-mode = "streaming"  # or "block"
-# Create an instance of the oscilloscope
-osc = Oscilloscope(
-    mode=mode,
-    single_buff_size=single_buffer_size,
-    n_buffs=n_buffers,
-    pretrigger_size=pretrigger_size,
-    posttrigger_size=posttrigger_size,
-)
-# Open the oscilloscope
-status = osc.open_device()
-print(status)
-status = osc.initialize_device(channels, buffers)
-
-# Spectrometer
-devices = list_devices()
-print(devices)
-spec = Spectrometer(devices[0])
-spec.integration_time_micros(int_time_treat) ## change integration time (units of microseconds)
-
-# Thermal Camera
-dev, ctx = tc_utils.openThermalCamera()
-print("Devices opened/connected to sucessfully!")
-
-devices = {}
-devices["arduinoPI"] = arduinoPI
-devices["arduinoAddress"] = arduinoAddress
-devices["osc"] = osc
-devices["spec"] = spec
+devices = devices_future.result()
+executor.shutdown()
+arduinoPI = devices["arduinoPI"]
+arduinoAddress = devices["arduinoAddress"]
+osc = devices["osc"]
+spec = devices["spec"]
+s = time.perf_counter_ns()
 
 # send startup inputs
 time.sleep(2)
 ard_utils.sendInputsArduino(arduinoPI, 2.0, 2.0, dutyCycleIn, arduinoAddress)
+# initialize the measurements while the plasma is ignited
+ioloop = runtime.start_event_loop()
+warmup = runtime.start_warmup(devices, runOpts, ioloop)
 input("Ensure plasma has ignited and press return/enter to begin.\n")
 
 ## Startup asynchronous measurement
-if os.name == 'nt':
-    ioloop = asyncio.ProactorEventLoop() # for subprocess' pipes on Windows
-    asyncio.set_event_loop(ioloop)
-else:
-    ioloop = asyncio.get_event_loop()
-# run once to initialize measurements
-prevTime = (time.time()-s)*1e3
-tasks, runTime = ioloop.run_until_complete(
-    ameas.async_measure(arduinoPI, osc, spec, runOpts)
-)
-print('measurement devices ready!')
-
-# get initial measurements
-tasks, runTime = ioloop.run_until_complete(
-    ameas.async_measure(arduinoPI, osc, spec, runOpts)
+# wait for the measurements to be initialized and get initial measurements
+warmup.result()
+print("measurement devices ready!")
+prevTime = (time.perf_counter_ns()-s)/1e6
+results, runTime = runtime.run_on_loop(
+    ioloop,
+    ameas.async_measure(arduinoPI, osc, spec, runOpts, devices["wavelengths"]),
 )
 if runOpts.collectData:
-    thermalCamOut = tasks[0].result()
+    thermalCamOut = results[0]
     Ts0 = thermalCamOut[0]
-    specOut = tasks[1].result()
+    specOut = results[1]
     I0 = specOut[0]
-    oscOut = tasks[2].result()
-    arduinoOut = tasks[3].result()
+    oscOut = results[2]
+    arduinoOut = results[3]
     outString = "Measured Outputs: Temperature: %.2f, Intensity: %.2f" % (Ts0, I0)
     print(outString)
 else:
     Ts0 = 37
     I0 = 100
 
-s = time.time()
+s = time.perf_counter_ns()
 
 ################################################################################
 ## Begin Experiment:
@@ -187,13 +166,13 @@ s = time.time()
 Nsim = int(time_treat/runOpts.tSampling)
 exp = Experiment(Nsim, saveDir)
 
-f = open(saveDir+"notes.txt", 'a')
-f.write(settings_str)
+with open(saveDir+"notes.txt", 'a') as f:
+    f.write(settings_str)
 
 for i in range(Nrep):
     # create input sequences
-    pseq = P_treat*np.ones((Nsim,))
-    qseq = q_treat*np.ones((Nsim,))
+    pseq = np.full((Nsim,), P_treat)
+    qseq = np.full((Nsim,), q_treat)
     print(pseq)
     print(qseq)
 
@@ -201,29 +180,29 @@ for i in range(Nrep):
     opt_dict = {}
     opt_dict["exp_settings"] = settings_str
 
-    exp_data = exp.run_open_loop(
-        ioloop,
+    exp_data = runtime.run_on_loop(ioloop, exp.async_run_open_loop(
         power_seq=pseq,
         flow_seq=qseq,
         runOpts=runOpts,
         devices=devices,
         prevTime=prevTime,
         opt_dict=opt_dict,
-    )
-
-    arduinoPI.close()
+    ))
 
-    # reconnect Arduino
-    arduinoPI = serial.Serial(arduinoAddress, baudrate=38400, timeout=1)
-    devices['arduinoPI'] = arduinoPI
+    # clear stale serial data between repetitions (reopening the port would
+    # reset the Arduino)
+    arduinoPI.reset_input_buffer()
+    arduinoPI.reset_output_buffer()
 
 # turn off plasma jet (programmatically)
 ard_utils.sendInputsArduino(arduinoPI, 0.0, 0.0, dutyCycleIn, arduinoAddress)
 arduinoPI.close()
+osc.stop_streaming_thread()
+# wait for the experimental data to be saved
+exp.wait_for_saves()
+runtime.stop_event_loop(ioloop)
 
 if plot_data:
-    import matplotlib.pyplot as plt
-
     fig, (ax1, ax2, ax3, ax4) = plt.subplots(4,1, figsize=(8,8), dpi=150, layout="constrained")
     ax1.plot(exp_data['Tsave'])
     ax1.set_ylabel('Maximum Surface\nTemperature ($^\circ$C)')
@@ -234,7 +213,9 @@ if plot_data:
     ax4.plot(exp_data['qSave'])
     ax4.set_ylabel('Carrier Gas\nFlow Rate (SLM)')
     ax4.set_xlabel('Time Step')
-    plt.show()
+    fig.savefig(saveDir+'summary.png')
+    if matplotlib.get_backend().lower() != 'agg':
+        plt.show()
     
 print("Experiment complete!\n"+
     "################################################################################################################\n"+
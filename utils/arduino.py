@@ -4,10 +4,79 @@
 
 import subprocess
 import time
+import asyncio
 import numpy as np
 import crcmod
 crc8 = crcmod.predefined.mkCrcFun('crc-8-maxim')
 
+# indices of the embedded measurements in a line read from the Arduino, in the
+# order returned by parseMeasArduino; the line is indexed as programmed on the
+# Arduino:
+#   0 time stamp, 1 p2p Voltage, 2 frequency, 3 Helium flow rate, 4 Z position,
+#   5 duty cycle, 6 embedded intensity, 7 embedded voltage, 8 embedded
+#   temperature, 9 embedded current, 10 X position, 11 Y position, 12 Oxygen
+#   flow rate, 13 power setpoint, 14 embedded power
+MEAS_IDX = np.array([6, 1, 2, 3, 10, 11, 4, 8, 14, 13, 5, 7, 9])
+# indices of the embedded measurements preceded by the time stamp, in the order
+# returned by async_get_emb (utils/async_measurement.py)
+EMB_IDX = np.concatenate(([0], MEAS_IDX))
+
+
+class BufferedArduino():
+    '''
+    The class BufferedArduino wraps the serial device object of the Arduino so
+    that lines are read from the serial port in blocks of the bytes currently
+    waiting, rather than one byte (and one system call) at a time as is done by
+    pyserial's readline. All other attributes are passed through to the
+    underlying serial device, so an instance may be used wherever the serial
+    device object was used before.
+    '''
+    def __init__(self, dev):
+        self.dev = dev
+        self._buf = bytearray()
+
+    def __getattr__(self, name):
+        return getattr(self.dev, name)
+
+    def readline(self):
+        '''
+        function to read one line (terminated by a newline character) from the
+        Arduino; returns an empty line if the serial timeout is reached before a
+        full line is received, in which case the bytes read so far are kept and
+        completed by the next call (so a short timeout does not split lines)
+        '''
+        idx = self._buf.find(b'\n')
+        while idx < 0:
+            chunk = self.dev.read(max(1, self.dev.in_waiting))
+            if not chunk:
+                return b''
+            self._buf += chunk
+            idx = self._buf.find(b'\n')
+        line = bytes(self._buf[:idx+1])
+        del self._buf[:idx+1]
+        return line
+
+    def read_available_line(self):
+        '''
+        function to read one line from the Arduino without waiting: only the
+        bytes already received are read, and an empty line is returned if a
+        full line has not been received yet (the bytes read so far are kept
+        for the next call)
+        '''
+        n_waiting = self.dev.in_waiting
+        if n_waiting:
+            self._buf += self.dev.read(n_waiting)
+        idx = self._buf.find(b'\n')
+        if idx < 0:
+            return b''
+        line = bytes(self._buf[:idx+1])
+        del self._buf[:idx+1]
+        return line
+
+    def reset_input_buffer(self):
+        self._buf.clear()
+        self.dev.reset_input_buffer()
+
 
 def sendInputsArduino(arduino, appliedPower, flow, dutyCycle, arduinoAddress):
     arduino.reset_input_buffer()
@@ -33,6 +102,49 @@ def sendControlledInputsArduino(arduino, appliedPower, flow, arduinoAddress):
     outString = "Input value(s): Power: %.2f, Flow: %.2f" %(appliedPower,flow)
     print(outString)
 
+def sendInputsArduinoNoWait(arduino, appliedPower, flow):
+    '''
+    function to send the power and flow rate inputs to the Arduino as one
+    packet through the already-open serial port, without the programmed pauses
+    of sendControlledInputsArduino. The function does not wait for the Arduino;
+    the next line read from the Arduino serves as the point at which the inputs
+    have been received.
+
+    Inputs:
+    arduino         serial device object for Arduino
+    appliedPower    power setpoint to send to the Arduino
+    flow            flow rate setpoint to send to the Arduino
+
+    Outputs:
+    None
+    '''
+    packet = "w,{:.2f}\nq,{:.2f}\n".format(appliedPower, flow).encode('ascii') #firmware v14
+    arduino.write(packet)
+    outString = "Input value(s): Power: %.2f, Flow: %.2f" %(appliedPower,flow)
+    print(outString)
+
+def send_and_measure(arduino, appliedPower, flow):
+    '''
+    function to send the power and flow rate inputs to the Arduino and read
+    back the embedded measurements in a single control cycle. Both commands are
+    framed into one packet and written through the already-open serial port,
+    rather than spawning a separate shell for each command.
+
+    Inputs:
+    arduino         serial device object for Arduino
+    appliedPower    power setpoint to send to the Arduino
+    flow            flow rate setpoint to send to the Arduino
+
+    Outputs:
+    array of embedded measurements (see getMeasArduino)
+    '''
+    packet = "w,{:.2f}\nq,{:.2f}\n".format(appliedPower, flow).encode('ascii') #firmware v14
+    arduino.write(packet)
+    arduino.flush()
+    outString = "Input value(s): Power: %.2f, Flow: %.2f" %(appliedPower,flow)
+    print(outString)
+    return getMeasArduino(arduino)
+
 def getMeasArduino(dev):
     '''
     function to get embedded measurements from the Arduino (microcontroller)
@@ -41,26 +153,8 @@ def getMeasArduino(dev):
     dev     device object for Arduino
 
     Outputs:
-    Is            embedded surface intensity measurement
-    U            inputs (applied peak to peak Voltage, frequency, flow rate)
-    x_pos        X position
-    y_pos        Y position
-    dsep        separation distance from jet tip to substrate (Z position)
-    T_emb        embedded temperature measurement
-    P_emb        embedded power measurement
-    Pset        power setpoint
-    Dc            duty cycle
-    elec        electrical measurements (embedded voltage and current)
+    array of embedded measurements (see parseMeasArduino)
     '''
-    # set default values for data/initialize data values
-    Is = 0
-    U = [0,0,0,0]    # inputs (applied Voltage, frequency, flow rate)
-    x_pos = 0
-    y_pos = 0
-    dsep = 0
-    T_emb = 0
-    elec = [0,0]    # electrical measurements (embedded voltage and current)
-
     # run the data capture
     run = True
     while run:
@@ -71,30 +165,153 @@ def getMeasArduino(dev):
             if is_line_valid(line):
                 # print(line)
                 run = False
-                # data read from line indexed as programmed on the Arduino
-                V = float(line.split(',')[1])    # p2p Voltage
-                f = float(line.split(',')[2])    # frequency
-                q = float(line.split(',')[3])    # Helium flow rate
-                dsep = float(line.split(',')[4])    # Z position
-                Dc = float(line.split(',')[5])    # duty cycle
-                Is = float(line.split(',')[6])    # embedded intensity
-                V_emb = float(line.split(',')[7])    # embedded voltage
-                T_emb = float(line.split(',')[8])    # embedded temperature
-                I_emb = float(line.split(',')[9])    # embedded current
-                x_pos = float(line.split(',')[10])    # X position
-                y_pos = float(line.split(',')[11])    # Y position
-                # q2 = float(line.split(',')[12])        # Oxygen flow rate
-                Pset = float(line.split(',')[13])    # power setpoint
-                P_emb = float(line.split(',')[14])    # embedded power
+                out = parseMeasArduino(line)
             else:
                 print("CRC8 failed. Invalid line!")
-            U = [V,f,q]
-            elec = [V_emb, I_emb]
         except Exception as e:
             print(e)
             pass
     print(line)
-    return np.array([Is,*U,x_pos,y_pos,dsep,T_emb,P_emb,Pset,Dc,*elec])
+    return out
+
+def parseMeasArduino(line):
+    '''
+    function to parse a (validated) line of embedded measurements from the
+    Arduino
+
+    Inputs:
+    line     line read from Arduino
+
+    Outputs:
+    Is            embedded surface intensity measurement
+    U            inputs (applied peak to peak Voltage, frequency, flow rate)
+    x_pos        X position
+    y_pos        Y position
+    dsep        separation distance from jet tip to substrate (Z position)
+    T_emb        embedded temperature measurement
+    P_emb        embedded power measurement
+    Pset        power setpoint
+    Dc            duty cycle
+    elec        electrical measurements (embedded voltage and current)
+    '''
+    # convert all fields of the line in one pass, then gather the fields in the
+    # order of the outputs (see MEAS_IDX)
+    data = np.array(line.split(',')[:15], dtype=np.float64)
+    return data[MEAS_IDX]
+
+
+class ArduinoProtocol(asyncio.Protocol):
+    '''
+    The class ArduinoProtocol is an asyncio protocol for the serial connection to
+    the Arduino (see openArduinoAsync). Lines streamed by the Arduino are
+    collected in a bounded queue as they arrive, so that waiting for a
+    measurement releases the event loop for other tasks. If the queue is full,
+    the oldest line is dropped.
+    '''
+    def __init__(self, maxlines=16):
+        self.transport = None
+        self.lines = asyncio.Queue(maxlines)
+        self._buf = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self._buf += data
+        *lines, rest = self._buf.split(b'\n')
+        self._buf = bytearray(rest)
+        for line in lines:
+            if self.lines.full():
+                self.lines.get_nowait()
+            self.lines.put_nowait(line.decode('ascii', errors='replace'))
+
+    def reset_input_buffer(self):
+        '''
+        function to discard lines (and partial lines) received so far
+        '''
+        self._buf.clear()
+        while not self.lines.empty():
+            self.lines.get_nowait()
+
+    def send_inputs(self, appliedPower, flow, dutyCycle=None):
+        '''
+        function to send input values to the Arduino; the duty cycle is only
+        sent if provided
+        '''
+        packet = "w,{:.2f}\nq,{:.2f}\n".format(appliedPower, flow) #firmware v14
+        if dutyCycle is not None:
+            packet = "p,{:.2f}\n".format(dutyCycle) + packet
+            outString = "Input values: Power: %.2f, Flow: %.2f, Duty Cycle: %.2f" %(appliedPower,flow,dutyCycle)
+        else:
+            outString = "Input value(s): Power: %.2f, Flow: %.2f" %(appliedPower,flow)
+        self.transport.write(packet.encode('ascii'))
+        print(outString)
+
+    async def get_measurement(self, timeout=1.0):
+        '''
+        coroutine to get the next complete, valid line of embedded measurements
+        from the Arduino; raises asyncio.TimeoutError if no line is received
+        within timeout seconds
+
+        Outputs:
+        array of embedded measurements (see parseMeasArduino)
+        '''
+        self.reset_input_buffer()
+        while True:
+            line = await asyncio.wait_for(self.lines.get(), timeout)
+            try:
+                if is_line_valid(line):
+                    print(line)
+                    return parseMeasArduino(line)
+                else:
+                    print("CRC8 failed. Invalid line!")
+            except Exception as e:
+                print(e)
+
+    def close(self):
+        self.transport.close()
+
+
+async def openArduinoAsync(arduinoAddress, baudrate=38400):
+    '''
+    coroutine to open an asynchronous serial connection to the Arduino using
+    pyserial-asyncio
+
+    Inputs:
+    arduinoAddress      path of the connected device (Arduino)
+    baudrate            baud rate of the serial connection
+
+    Outputs:
+    ArduinoProtocol instance for the connection
+    '''
+    import serial_asyncio
+
+    loop = asyncio.get_running_loop()
+    transport, protocol = await serial_asyncio.create_serial_connection(
+        loop, ArduinoProtocol, arduinoAddress, baudrate=baudrate
+    )
+    return protocol
+
+def setLowLatencyArduino(arduino):
+    '''
+    function to request low latency mode on the serial port of the Arduino so
+    that received lines are handed to the reader without the driver's receive
+    latency. Not all drivers/platforms support this (e.g., it is Linux only),
+    in which case the port is left unchanged.
+
+    Inputs:
+    arduino     serial device object of the Arduino (pyserial)
+
+    Outputs:
+    True if low latency mode was set, False otherwise
+    '''
+    try:
+        arduino.set_low_latency_mode(True)
+        return True
+    except (AttributeError, NotImplementedError, ValueError, OSError):
+        print('WARNING: Low latency mode not supported on the Arduino port.')
+        return False
+
 
 def getArduinoAddress(os="macos"):
     '''
@@ -145,15 +362,13 @@ def is_line_valid(line):
     and correct
 
     Inputs:
-    line     line read from Arduino
+    line     line read from Arduino (str, or bytes as read from the serial port)
 
     Outputs:
     boolean value representing the verification of the line
     '''
-    l = line.split(',')
-    crc = int(l[-1])
-    data = ','.join(l[:-1])
-    return crc_check(data,crc)
+    data, _, crc = line.rpartition(b',' if isinstance(line, bytes) else ',')
+    return crc_check(data,int(crc))
 
 def crc_check(data,crc):
     '''
@@ -161,12 +376,14 @@ def crc_check(data,crc):
     with data collected
 
     Inputs:
-    data         line of data collected
+    data         line of data collected (str or bytes)
     crc         CRC value
 
     Outputs:
     boolean value representing the verification of the CRC
     '''
-    crc_from_data = crc8("{}\x00".format(data).encode('ascii'))
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    crc_from_data = crc8(data + b'\x00')
     # print("crc:{} calculated: {} data: {}".format(crc,crc_from_data,data))
     return crc == crc_from_data
@@ -8,8 +8,13 @@ import numpy as np
 from utils.thermal_camera import *
 from utils.arduino import *
 
+# pixels of the spectrum used for the mean shift (background) and the pixels
+# summed for the total intensity
+SPEC_SHIFT_PIX = slice(-20, -1)
+SPEC_SUM_PIX = slice(20, None)
 
-async def async_measure(ard, osc, spec, runOpts):
+
+async def async_measure(ard, osc, spec, runOpts, wavelengths=None):
     """
     function to get measurements from all devices asynchronously to optimize
     time to get measurements
@@ -19,31 +24,65 @@ async def async_measure(ard, osc, spec, runOpts):
     spec        Spectrometer device reference
     runOpts     run options; if data should be saved, then measurements will be
                 taken, otherwise the task will return None
+    wavelengths (optional) wavelengths of the spectrometer, fetched once at
+                startup; if None, they are read from the spectrometer
 
     Outputs:
-    tasks        completed list of tasks containing data measurements; the first
-                task obtains temperature measurements, second task obtains
-                spectrometer measurements, third task gets oscilloscope
-                measurements, and the fourth (final) task gets embedded
+    results     list of the data measurements; the first entry contains the
+                temperature measurements, second entry contains the
+                spectrometer measurements, third entry contains the oscilloscope
+                measurements, and the fourth (final) entry contains the embedded
                 measurements from the Arduino output
     runTime     run time to complete all tasks
     """
-    # create list of tasks to complete asynchronously
-    tasks = [
-        asyncio.create_task(async_get_temp(runOpts)),
-        asyncio.create_task(async_get_spectra(spec, runOpts)),
-        asyncio.create_task(async_get_osc(osc, runOpts)),
-        asyncio.create_task(async_get_emb(ard, runOpts)),
-    ]
-
-    startTime = time.time()
-    await asyncio.wait(tasks)
-    # await asyncio.gather(*tasks)
-    endTime = time.time()
-    runTime = endTime - startTime
+    startTime = time.perf_counter_ns()
+    # gather schedules the measurement coroutines itself, so they are passed
+    # directly rather than wrapped in tasks
+    results = await asyncio.gather(
+        async_get_temp(runOpts),
+        async_get_spectra(spec, runOpts, wavelengths),
+        async_get_osc(osc, runOpts),
+        async_get_emb(ard, runOpts),
+    )
+    endTime = time.perf_counter_ns()
+    runTime = (endTime - startTime) * 1e-9
     # print time to complete measurements
     print("...completed data collection tasks after {} seconds".format(runTime))
-    return tasks, runTime
+    return results, runTime
+
+
+async def async_measure_as_completed(ard, osc, spec, runOpts, wavelengths=None):
+    """
+    asynchronous generator that gets measurements from all devices (as in
+    async_measure) and yields each measurement as soon as it is completed, so
+    that it can be processed while the remaining measurements are taken
+
+    Inputs:
+    ard         Arduino device reference
+    osc         custom object for oscilloscope
+    spec        Spectrometer device reference
+    runOpts     run options
+    wavelengths (optional) wavelengths of the spectrometer (see async_measure)
+
+    Outputs (yielded, in order of completion):
+    idx         index of the measurement; 0 for temperature measurements, 1 for
+                spectrometer measurements, 2 for oscilloscope measurements and
+                3 for embedded measurements from the Arduino output (the order
+                of the results of async_measure)
+    result      data measurement
+    """
+
+    async def tagged(idx, coro):
+        return idx, await coro
+
+    coros = [
+        tagged(0, async_get_temp(runOpts)),
+        tagged(1, async_get_spectra(spec, runOpts, wavelengths)),
+        tagged(2, async_get_osc(osc, runOpts)),
+        tagged(3, async_get_emb(ard, runOpts)),
+    ]
+    for fut in asyncio.as_completed(coros):
+        yield await fut
 
 
 async def async_get_temp(runOpts):
@@ -62,14 +101,33 @@ async def async_get_temp(runOpts):
     Ts2        average spatial temperature from 2 pixels away from Ts in Celsius
     Ts3     average spatial temperature from 12 pixels away from Ts in Celsius
     data    raw data matrix of the image captured
-    if data collection is specified otherwise, outputs None
+    the spatial temperatures are -300 and the image data is None if they are
+    not collected/saved (see runOpts); if data collection is specified
+    otherwise, outputs None
     """
     if runOpts.collectData:
+        # only compute the spatial temperatures and the image if they are used
+        save_spatial = runOpts.collectSpatialTemp or runOpts.saveSpatialTemp
+        save_image = runOpts.saveEntireImage
+        Ts_spatial = (-300, -300)
+        img_data = None
         # run the data capture
         run = True
         while run:
-            Ts_max, Ts_spatial, img_data = getSurfaceTemperature(True, True)
+            # run the blocking frame capture in a worker thread so the other
+            # measurements are not held up
+            out = await asyncio.get_running_loop().run_in_executor(
+                None, getSurfaceTemperature, save_spatial, save_image
+            )
             run = False
+        if save_spatial and save_image:
+            Ts_max, Ts_spatial, img_data = out
+        elif save_spatial:
+            Ts_max, Ts_spatial = out
+        elif save_image:
+            Ts_max, img_data = out
+        else:
+            Ts_max = out
         # print('temperature measurement done!')
         # return [Ts, Ts2, Ts3, data]
         return [Ts_max, *Ts_spatial, img_data]
@@ -77,13 +135,15 @@ async def async_get_temp(runOpts):
         return None
 
 
-async def async_get_spectra(spec, runOpts):
+async def async_get_spectra(spec, runOpts, wavelengths=None):
     """
     asynchronous definition of optical emission spectra data
 
     Inputs:
     spec         Spectrometer device
     runOpts     run options
+    wavelengths (optional) wavelengths of the spectrometer, which are fixed for
+                the device; if None, they are read from the spectrometer
 
     Outputs:
     totalIntensity        total intensity measurement
@@ -92,13 +152,18 @@ async def async_get_spectra(spec, runOpts):
     if data collection is specified otherwise, outputs None
     """
     if runOpts.collectData and spec is not None:
-        intensitySpectrum = spec.intensities()
-        meanShift = np.mean(intensitySpectrum[-20:-1])
-        intensitySpectrum = intensitySpectrum - meanShift
-        totalIntensity = sum(intensitySpectrum[20:])
+        loop = asyncio.get_running_loop()
+        # run the blocking USB reads in a worker thread so the other
+        # measurements are not held up
+        intensitySpectrum = await loop.run_in_executor(None, spec.intensities)
+        meanShift = np.mean(intensitySpectrum[SPEC_SHIFT_PIX])
+        # shift in place (the spectrometer returns a new array for each read)
+        np.subtract(intensitySpectrum, meanShift, out=intensitySpectrum)
+        totalIntensity = float(np.sum(intensitySpectrum[SPEC_SUM_PIX]))
 
         if runOpts.collectEntireSpectra:
-            wavelengths = spec.wavelengths()
+            if wavelengths is None:
+                wavelengths = await loop.run_in_executor(None, spec.wavelengths)
         else:
             wavelengths = None
         # print('spectra recorded!')
@@ -107,6 +172,43 @@ async def async_get_spectra(spec, runOpts):
         return None
 
 
+async def async_readline(dev, timeout=1.0):
+    """
+    asynchronous definition to read one line from the Arduino without blocking
+    the event loop. Where supported (a BufferedArduino on a loop that can watch
+    file descriptors, i.e., not the Windows proactor loop), the event loop
+    watches the serial port so that the coroutine wakes up as soon as bytes
+    arrive; otherwise the blocking readline is run in a worker thread.
+
+    Inputs:
+    dev         device object for Arduino
+    timeout     time (s) to wait for a full line
+
+    Outputs:
+    line        line read (bytes); empty if no full line was received in time
+    """
+    loop = asyncio.get_running_loop()
+    if hasattr(dev, "read_available_line"):
+        try:
+            fd = dev.fileno()
+            endTime = loop.time() + timeout
+            line = dev.read_available_line()
+            while not line and loop.time() < endTime:
+                readable = loop.create_future()
+                loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+                try:
+                    await asyncio.wait_for(readable, endTime - loop.time())
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    loop.remove_reader(fd)
+                line = dev.read_available_line()
+            return line
+        except NotImplementedError:
+            pass
+    return await loop.run_in_executor(None, dev.readline)
+
+
 async def async_get_emb(dev, runOpts, prevTime=0.0):
     """
     asynchronous definition to get embedded measurements from the Arduino
@@ -131,60 +233,34 @@ async def async_get_emb(dev, runOpts, prevTime=0.0):
     if data collection is specified otherwise, outputs None
     """
     if runOpts.collectEmbedded and dev is not None:
-        # set default values for data/initialize data values
-        Is = 0
-        U = [0, 0, 0]  # inputs (applied Voltage, frequency, flow rate)
-        x_pos = 0
-        y_pos = 0
-        dsep = 0
-        T_emb = 0
-        elec = [0, 0]  # electrical measurements (embedded voltage and current)
-        P_emb = 0
-        Pset = 0
-        Dc = 0
-
         # run the data capture
         run = True
         while run:
             try:
                 # dev.reset_input_buffer()
                 # dev.readline()
-                line = dev.readline().decode("ascii")
+                # read without holding up the other measurements while waiting
+                # for a line; the line is validated and parsed as bytes
+                # (without decoding)
+                line = await async_readline(dev)
+                if not line:
+                    # serial timeout before a full line was received
+                    continue
                 if is_line_valid(line):
                     # print(line)
-                    data = line.split(",")
-                    timeStamp = float(data[0])
-                    if True:
-                        # if (timeStamp-prevTime)/1e3 >= runOpts.tSampling-0.025:
-                        run = False
-                        # data read from line indexed as programmed on the Arduino
-                        V = float(data[1])  # p2p Voltage
-                        f = float(data[2])  # frequency
-                        q = float(data[3])  # Helium flow rate
-                        dsep = float(data[4])  # Z position
-                        Dc = float(data[5])  # duty cycle
-                        Is = float(data[6])  # embedded intensity
-                        V_emb = float(data[7])  # embedded voltage
-                        T_emb = float(data[8])  # embedded temperature
-                        I_emb = float(data[9])  # embedded current
-                        x_pos = float(data[10])  # X position
-                        y_pos = float(data[11])  # Y position
-                        # q2 = float(data[12])        # Oxygen flow rate
-                        Pset = float(data[13])  # power setpoint
-                        P_emb = float(data[14])  # embedded power
-
-                        U = [V, f, q]
-                        elec = [V_emb, I_emb]
+                    run = False
+                    # data read from line indexed as programmed on the Arduino
+                    # (see MEAS_IDX in utils/arduino.py), converted in one call
+                    # and reordered to the output order
+                    out = np.array(line.split(b",")[:15], dtype=np.float64)[EMB_IDX]
                 else:
                     print("CRC8 failed. Invalid line!")
             except Exception as e:
                 print(e)
                 pass
-        print(line)
+        print(line.decode("ascii"))
         # print('embedded measurement done!')
-        return np.array(
-            [timeStamp, Is, *U, x_pos, y_pos, dsep, T_emb, P_emb, Pset, Dc, *elec]
-        )
+        return out
     else:
         return None
 
@@ -203,7 +279,27 @@ async def async_get_osc(osc, runOpts):
     if data collection is specified otherwise, outputs None
     """
     if runOpts.collectOscMeas and osc is not None:
-        t, ch_datas = osc.collect_data_streaming()
+        if osc.stream_thread is not None:
+            # take the latest capture of the streaming thread; only wait (in a
+            # worker thread) if no new capture is ready yet
+            out = osc.get_streamed_data(block=False)
+            if out is None:
+                out = await asyncio.get_running_loop().run_in_executor(
+                    None, osc.get_streamed_data
+                )
+            if out is None:
+                # the streaming thread stopped without an error (an error of
+                # the thread is raised by get_streamed_data)
+                raise RuntimeError(
+                    "Oscilloscope streaming thread stopped; no oscilloscope data to collect!"
+                )
+            t, ch_datas = out
+        else:
+            # run the blocking capture in a worker thread so the other
+            # measurements are not held up
+            t, ch_datas = await asyncio.get_running_loop().run_in_executor(
+                None, osc.collect_data_streaming
+            )
         return [t, ch_datas]
     else:
         return None
@@ -0,0 +1,226 @@
+# experiment runtime
+#
+# This file defines the startup shared by the open loop experiment scripts
+# (run_OLexp.py and run_single_sample_OLexp.py): configuring the run options,
+# setting the save location, and opening the devices of the APPJ testbed.
+#
+# Requirements:
+# * Python 3
+# * Seabreeze, pyserial, picosdk and libuvc for connection to the experimental
+# setup
+#
+# Copyright (c) 2021 Mesbah Lab. All Rights Reserved.
+# Kimberly Chan
+#
+# This file is under the MIT License. A copy of this license is included in the
+# download of the entire code package (within the root folder of the package).
+
+## import 3rd party packages
+import os
+import asyncio
+import threading
+import serial
+from seabreeze.spectrometers import Spectrometer, list_devices
+
+## import user functions
+from utils.run_options import RunOpts
+import utils.thermal_camera as tc_utils
+import utils.arduino as ard_utils
+import utils.async_measurement as ameas
+from utils.oscilloscope import Oscilloscope
+
+## import picoscope settings
+from picoscope_setup import (
+    single_buffer_size,
+    n_buffers,
+    pretrigger_size,
+    posttrigger_size,
+    channels,
+    buffers,
+)
+
+
+def get_run_options(ts):
+    '''
+    function to configure the run options used by the open loop experiments
+
+    Inputs:
+    ts          sampling time of the measurements (s)
+
+    Outputs:
+    runOpts     run options (see utils/run_options.py)
+    '''
+    runOpts = RunOpts()
+    runOpts.collectData = True  # option to collect two-input, two-output data (power, flow rate); (max surface temperature, total intensity)
+    runOpts.collectEntireSpectra = True  # option to collect full intensity spectra
+    runOpts.collectOscMeas = True  # option to collect oscilloscope measurements (using PicoScope)
+    runOpts.collectSpatialTemp = False  # option to collect spatial temperature (defined as temperature from 12 pixels away from max in the four cardinal directions)
+    # save options; correspond to the collection (two-input, two-output data is always saved)
+    runOpts.saveSpectra = True
+    runOpts.saveOscMeas = True
+    runOpts.saveSpatialTemp = False  # limited functionality
+    runOpts.saveEntireImage = True
+    runOpts.tSampling = ts  # set the sampling time of the measurements
+    return runOpts
+
+
+def get_save_dir(timeStamp, label):
+    '''
+    function to get (and create) the save location of the experimental data,
+    which is a folder named by the time stamp and label next to the
+    repository, i.e., ../<repo>-ExperimentalData/<timeStamp><label>/
+
+    Inputs:
+    timeStamp   time stamp of the experiment
+    label       label appended to the time stamp
+
+    Outputs:
+    saveDir     path to the save location
+    '''
+    directory = os.getcwd()
+    split_cwd = directory.split("/")
+    repo = split_cwd[-1]
+    saveDir = directory + f"/../{repo}-ExperimentalData/" + timeStamp + label + "/"
+    # create the folder up front so that nothing written during the experiment
+    # has to check for (or create) it
+    os.makedirs(saveDir, exist_ok=True)
+    return saveDir
+
+
+def setup_devices(int_time, arduinoAddress=None):
+    '''
+    function to connect to/open connections to the devices in the setup
+
+    Inputs:
+    int_time        integration time of the spectrometer (us)
+    arduinoAddress  (optional) path of the Arduino device; if None, it is found
+                    with ard_utils.getArduinoAddress, which may ask for user
+                    input (so resolve it beforehand if this function is run in
+                    the background)
+
+    Outputs:
+    devices     dictionary of the opened devices, with keys "arduinoPI" (serial
+                device of the Arduino), "arduinoAddress", "osc" (oscilloscope),
+                "spec" (spectrometer), "wavelengths" (wavelengths of the
+                spectrometer) and "camera" (thermal camera device and context)
+    '''
+    # Arduino
+    if arduinoAddress is None:
+        arduinoAddress = ard_utils.getArduinoAddress(os="ubuntu")
+    print("Arduino Address: ", arduinoAddress)
+    # short timeout so a missing line does not stall the measurements; partial
+    # lines are kept by BufferedArduino until they are completed
+    arduinoPI = ard_utils.BufferedArduino(
+        serial.Serial(arduinoAddress, baudrate=38400, timeout=0.05)
+    )
+    ard_utils.setLowLatencyArduino(arduinoPI)
+
+    # Oscilloscope
+    mode = "streaming"  # or "block"
+    # Create an instance of the oscilloscope
+    osc = Oscilloscope(
+        mode=mode,
+        single_buff_size=single_buffer_size,
+        n_buffs=n_buffers,
+        pretrigger_size=pretrigger_size,
+        posttrigger_size=posttrigger_size,
+    )
+    # Open the oscilloscope
+    status = osc.open_device()
+    print(status)
+    status = osc.initialize_device(channels, buffers)
+    if mode == "streaming":
+        # acquire continuously on a dedicated thread; the measurements take the
+        # latest capture
+        osc.start_streaming_thread()
+
+    # Spectrometer
+    spec_devices = list_devices()
+    print(spec_devices)
+    spec = Spectrometer(spec_devices[0])
+    spec.integration_time_micros(int_time)  ## change integration time (units of microseconds)
+    wavelengths = spec.wavelengths()  # fixed for the device, so read once
+
+    # Thermal Camera
+    dev, ctx = tc_utils.openThermalCamera()
+    print("Devices opened/connected to sucessfully!")
+
+    devices = {}
+    devices["arduinoPI"] = arduinoPI
+    devices["arduinoAddress"] = arduinoAddress
+    devices["osc"] = osc
+    devices["spec"] = spec
+    devices["wavelengths"] = wavelengths
+    devices["camera"] = (dev, ctx)
+    return devices
+
+
+def close_devices(devices):
+    '''
+    function to close the devices opened by setup_devices, e.g., if the
+    experiment is not run after the devices are opened
+
+    Inputs:
+    devices     dictionary of the opened devices (see setup_devices)
+    '''
+    devices["arduinoPI"].close()
+    devices["osc"].stop_and_close_device()
+    devices["spec"].close()
+    tc_utils.closeThermalCamera(*devices["camera"])
+
+
+def start_event_loop():
+    '''
+    function to start an event loop on a dedicated (daemon) thread, which is
+    kept running for the whole session so that each measurement/experiment
+    does not set up and tear down its own event loop (and worker threads)
+
+    Outputs:
+    loop        the running event loop; use run_on_loop to run coroutines on it
+                and stop_event_loop to stop it
+    '''
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def run_on_loop(loop, coro):
+    '''
+    function to run a coroutine on the event loop started by start_event_loop
+    and wait for its result
+    '''
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def stop_event_loop(loop):
+    '''
+    function to stop the event loop started by start_event_loop
+    '''
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def start_warmup(devices, runOpts, loop):
+    '''
+    function to start a first measurement from all devices, which initializes
+    the measurements, on the (running) event loop so that it can run while
+    waiting for user input (e.g., while the plasma is ignited)
+
+    Inputs:
+    devices     dictionary of the opened devices (see setup_devices)
+    runOpts     run options
+    loop        event loop started by start_event_loop
+
+    Outputs:
+    warmup      future of the warm-up measurement; call warmup.result() before
+                taking any further measurements
+    '''
+    return asyncio.run_coroutine_threadsafe(
+        ameas.async_measure(
+            devices["arduinoPI"],
+            devices["osc"],
+            devices["spec"],
+            runOpts,
+            devices["wavelengths"],
+        ),
+        loop,
+    )
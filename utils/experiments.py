@@ -19,11 +19,20 @@ import sys
 sys.dont_write_bytecode = True
 import numpy as np
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
 import json
+import base64
+import mmap
+import zlib
 import h5py
 from enum import Enum
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 ## import user functions
 from utils.run_options import RunOpts
@@ -43,21 +52,84 @@ def ctok(T):
 def cem_acc(T, ts):
     """
     method that computes the thermal dose accumulation, assumes temperature is
-    given in units of Celsius and sampling time (ts) is given in seconds
+    given in units of Celsius and sampling time (ts) is given in seconds;
+    T may be a single temperature or an array of temperatures (e.g., Tsave), in
+    which case the accumulation at each temperature is returned
     """
-    if T < 30:
-        K = 0.25
-    else:
-        K = 0.5
-    return K ** (43 - T) * ts / 60
+    T = np.asarray(T, dtype=np.float64)
+    K = np.where(T < 30, 0.25, 0.5)
+    return (K ** (43.0 - T) * ts / 60.0)[()]
+
+def release_memmap(mm, start=None, stop=None):
+    """
+    Function to write the changes of a memmap to its file and advise the
+    kernel that its pages are no longer needed, so that they do not remain
+    resident after the memmap (or part of it) is finished with. If start and
+    stop are given, only the (whole) pages of the rows start:stop (along the
+    first axis) are released. (The advice is skipped on platforms that do not
+    support it.)
+    """
+    if mm is None:
+        return
+    mm.flush()
+    # np.memmap does not expose its mmap.mmap object publicly; it is kept in the
+    # (private) _mmap attribute, so it is looked up defensively and the advice
+    # is skipped if it is not available (e.g., in a future NumPy release); the
+    # data is written to the file by flush above either way
+    buf = getattr(mm, "_mmap", None)
+    if not hasattr(mmap, "MADV_DONTNEED") or not isinstance(buf, mmap.mmap):
+        return
+    if start is None:
+        buf.madvise(mmap.MADV_DONTNEED)
+        return
+    # position of the rows in the mapping, which starts at the allocation
+    # granularity boundary below the offset of the memmap
+    data_offset = mm.offset % mmap.ALLOCATIONGRANULARITY
+    first = data_offset + start*mm.strides[0]
+    last = data_offset + stop*mm.strides[0]
+    first = -(-first // mmap.PAGESIZE) * mmap.PAGESIZE
+    last = last // mmap.PAGESIZE * mmap.PAGESIZE
+    if last > first:
+        buf.madvise(mmap.MADV_DONTNEED, first, last - first)
+
+def json_default(o):
+    """
+    Function to encode the objects used in the experimental data that JSON does
+    not support (to be passed as the default of orjson.dumps): arrays are
+    encoded as their raw bytes (base64), rather than as lists of Python
+    numbers, and NumPy scalars as Python numbers. Use json_ndarray_hook to
+    decode the arrays.
+    """
+    if isinstance(o,np.ndarray):
+        return {
+            "__ndarray__": True,
+            "dtype": o.dtype.str,
+            "shape": o.shape,
+            "b64": base64.b64encode(np.ascontiguousarray(o).tobytes()).decode("ascii"),
+        }
+    elif isinstance(o,np.generic):
+        return o.item()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
 
 class CustomJSONEncoder(json.JSONEncoder):
+    # encoder for the standard library json module (used if orjson is not
+    # installed); see json_default
     def default(self, o):
-        if isinstance(o,np.ndarray):
-            return o.tolist()
+        if isinstance(o,(np.ndarray,np.generic)):
+            return json_default(o)
         else:
             return super().default(o)
 
+def json_ndarray_hook(d):
+    """
+    Function to decode the arrays encoded by CustomJSONEncoder (to be passed as
+    the object_hook of json.load).
+    """
+    if d.get("__ndarray__"):
+        data = base64.b64decode(d["b64"])
+        return np.frombuffer(data, dtype=np.dtype(d["dtype"])).reshape(d["shape"])
+    return d
+
 class DTypes(Enum):
     UINT8 = np.uint8
     FLOAT64 = np.float64
@@ -87,9 +159,8 @@ class Experiment:
         self.rand_seed = None
 
         self.saveDir = saveDir
-        if not os.path.exists(saveDir + "Backup/"):
-            self.backupSaveDir = saveDir + "Backup/"
-            os.makedirs(saveDir + "Backup", exist_ok=True)
+        self.backupSaveDir = saveDir + "Backup/"
+        os.makedirs(self.backupSaveDir, exist_ok=True)
         print("\n\nBackup data will be saved in the following directory:")
         print(self.backupSaveDir)
         self.count = 0
@@ -100,6 +171,40 @@ class Experiment:
             self.exp_name = self.name + "_Experiment_" + str(self.count)
 
         self.ol_count = 0
+        # the data of each experiment is saved in the background (one save at
+        # a time, in order) so that the next experiment does not wait for it
+        self._save_pool = ThreadPoolExecutor(max_workers=1)
+        self._save_futures = []
+
+    def wait_for_saves(self):
+        """
+        This method waits for the data of all experiments run so far to be
+        saved, and raises any error that occurred while saving. The wait blocks
+        the calling thread, so it is meant to be called by the experiment
+        script (e.g., before the devices are closed), not from a coroutine on
+        the event loop; there, use
+        await loop.run_in_executor(None, self.wait_for_saves) instead.
+        """
+        futures, self._save_futures = self._save_futures, []
+        for future in futures:
+            future.result()
+
+    def _save_exp_data(self, exp_data, exp_name, runOpts):
+        """
+        This method saves the backup copy and the segregated data files of the
+        data of one experiment (run in the background by the save thread).
+        """
+        print("\n\n\n****************************\n"+"saving HDF5 file of experimental data as backup ...")
+        s = time.time()
+        exp_data_backup(exp_data, self.backupSaveDir, exp_name)
+        print(f"saved backup, took {time.time()-s} seconds")
+
+        # save separate files of each type of experimental data
+        print("\n\n\n****************************\n"+"saving segregated data files ...")
+        exp_saveDir = self.saveDir
+        if not os.path.exists(exp_saveDir):
+            os.makedirs(exp_saveDir, exist_ok=True)
+        exp_data_saver(exp_data, exp_saveDir, exp_name, runOpts)
 
     def load_prob_info(self, prob_info):
         """
@@ -140,7 +245,33 @@ class Experiment:
     ):
         """
         This method runs a open-loop experiment of the APPJ using provided
-        sequences of inputs.
+        sequences of inputs on the given event loop. See async_run_open_loop.
+        """
+        return ioloop.run_until_complete(
+            self.async_run_open_loop(
+                power_seq=power_seq,
+                flow_seq=flow_seq,
+                runOpts=runOpts,
+                devices=devices,
+                prevTime=prevTime,
+                opt_dict=opt_dict,
+            )
+        )
+
+    async def async_run_open_loop(
+        self,
+        power_seq=None,
+        flow_seq=None,
+        runOpts=RunOpts(),
+        devices=None,
+        prevTime=0.0,
+        opt_dict=None,
+    ):
+        """
+        This method runs a open-loop experiment of the APPJ using provided
+        sequences of inputs. The entire experiment runs as a single coroutine,
+        so the measurements of each iteration are awaited on the running event
+        loop rather than entering the event loop once per iteration.
         """
         # check for provided sequence of inputs
         if power_seq is None and flow_seq is None:
@@ -205,38 +336,57 @@ class Experiment:
             else:
                 osc = None
                 print(f"WARNING: {key} not in devices dict! Code will error...")
+            # wavelengths of the spectrometer (read from the spectrometer if not given)
+            wavelengths = devices.get("wavelengths")
 
         # initial measurement to get data sizes
-        tasks, runTime = ioloop.run_until_complete(
-            ameas.async_measure(arduinoPI, osc, spec, runOpts)
+        results, runTime = await ameas.async_measure(
+            arduinoPI, osc, spec, runOpts, wavelengths
         )
-        thermalCamOut = tasks[0].result()
+        thermalCamOut = results[0]
         Ts0 = thermalCamOut[0]
-        specOut = tasks[1].result()
+        specOut = results[1]
         I0 = specOut[0]
-        oscOut = tasks[2].result()
-        arduinoOut = tasks[3].result()
+        oscOut = results[2]
+        arduinoOut = results[3]
 
         ## Instantiate container variables for storing experimental data
+        # the measurements are stored in single precision, which is more than
+        # the precision of the devices (e.g., the 16-bit spectrometer ADC and
+        # 8-bit oscilloscope ADC)
         if runOpts.saveData:
-            Tsave = np.empty((Niter,))
-            Isave = np.empty((Niter,))
+            Tsave = np.empty((Niter,), dtype=np.float32)
+            Isave = np.empty((Niter,), dtype=np.float32)
             badTimes = []
         if runOpts.saveSpatialTemp:
-            Ts2save = np.empty((Niter,))
-            Ts3save = np.empty((Niter,))
+            Ts2save = np.empty((Niter,), dtype=np.float32)
+            Ts3save = np.empty((Niter,), dtype=np.float32)
+        # name of the backup of this experiment; the scratch files below are
+        # named after it so that each experiment (of the same Experiment) keeps
+        # its own files, which its backup refers to
+        backup_name = "OL_data_" + str(self.ol_count)
         if runOpts.saveEntireImage:
             raw_img0 = thermalCamOut[3]
-            # create dictionary of options for memmap to use
-            mmap_opts = {"dtype": np.uint8, "shape": (N_PER_BAT_FILE, *raw_img0.shape)}
+            # create dictionary of options for memmap to use; all images are
+            # written to one memmap (file), which is created once, and the
+            # pages of each batch of N_PER_BAT_FILE images are released once
+            # the batch is finished
+            mmap_opts = {"dtype": np.uint8, "shape": (Niter, *raw_img0.shape)}
             # create list of memmap file names
-            raw_img_save_files = [self.backupSaveDir + f"tmp_img_data{n}.dat" for n in range(int(np.ceil(Niter/N_PER_BAT_FILE)))]
-            raw_img_save = None
+            raw_img_save_files = [self.backupSaveDir + f"tmp_img_data_{backup_name}.dat"]
+            raw_img_save = np.memmap(raw_img_save_files[0], mode="w+", **mmap_opts)
         if runOpts.saveSpectra:
             if specOut is not None:
                 waveSave = np.empty((len(specOut[2]),))
-                specSave = np.empty((Niter, len(specOut[2])))
-                meanShiftSave = np.empty((Niter,))
+                # back the spectra with a file so that long runs do not hold
+                # every spectrum in memory
+                specSave = np.memmap(
+                    self.backupSaveDir + f"tmp_spec_data_{backup_name}.dat",
+                    mode="w+",
+                    dtype=np.float32,
+                    shape=(Niter, len(specOut[2])),
+                )
+                meanShiftSave = np.empty((Niter,), dtype=np.float32)
             else:
                 print(
                     "Intensity Data not collected! Entire spectrum will not be saved."
@@ -244,116 +394,138 @@ class Experiment:
                 runOpts.saveSpectra = False
         if runOpts.saveOscMeas:
             if oscOut is not None:
+                # (channel, iteration, sample); the first row of each channel
+                # is the timebase of the data
                 n_channels = len(oscOut[1])
-                oscSave = [
-                    np.empty((Niter + 1, len(oscOut[0]))) for _ in range(n_channels)
-                ]
-                print(oscSave[0].shape)
+                oscSave = np.empty((n_channels, Niter + 1, len(oscOut[0])), dtype=np.float32)
+                print(oscSave.shape)
             else:
                 print("Oscilloscope data not collected! Nothing to save.")
                 runOpts.saveOscMeas = False
         if runOpts.saveEmbMeas:
             if arduinoOut is not None:
+                # (kept in double precision for the embedded time stamps, in
+                # ms, which exceed the precision of single precision in long
+                # runs)
                 ArdSave = np.empty((Niter, len(arduinoOut)))
             else:
                 print("Arduino Data not collected! Nothing to save.")
                 runOpts.saveEmbMeas = False
 
         for i in range(Niter):
-            startTime = time.time()
+            startTime = time.perf_counter_ns()
             print(f"\nIteration {i} out of {Niter}")
 
-            # asynchronous measurement
-            tasks, _ = ioloop.run_until_complete(
-                ameas.async_measure(arduinoPI, osc, spec, runOpts)
-            )
-
-            # Temperature
-            thermalCamMeasure = tasks[0].result()
-            if thermalCamMeasure is not None:
-                Ts = thermalCamMeasure[0]
-                Ts2 = thermalCamMeasure[1]
-                Ts3 = thermalCamMeasure[2]
-                raw_img = thermalCamMeasure[3]
-            else:
-                print(
-                    "Temperature data not collected! Thermal Camera measurements will be set to -300."
-                )
-                Ts = -300
-                Ts2 = -300
-                Ts3 = -300
-
-            # Total intensity
-            specOut = tasks[1].result()
-            if specOut is not None:
-                totalIntensity = specOut[0]
-                intensitySpectrum = specOut[1]
-                wavelengths = specOut[2]
-                meanShift = specOut[3]
-            else:
-                print(
-                    "Intensity data not collected! Spectrometer outputs will be set to -1."
-                )
-                totalIntensity = -1
-                intensitySpectrum = -1
-                wavelengths = -1
-                meanShift = -1
-
-            # Save measurements <--- takes on the order of 1-2e-5 seconds
-            if runOpts.saveData:
-                Tsave[i] = Ts
-                Isave[i] = totalIntensity
-            if runOpts.saveSpatialTemp:
-                Ts2save[i] = Ts2
-                Ts3save[i] = Ts3
-            if runOpts.saveEntireImage:
-                if np.mod(i, N_PER_BAT_FILE) == 0:
-                    n = int(i/N_PER_BAT_FILE)
-                    del raw_img_save
-                    raw_img_save = np.memmap(raw_img_save_files[n], mode="w+", **mmap_opts)
-                if len(raw_img.shape) == 2:
-                    raw_img_save[np.mod(i, N_PER_BAT_FILE), :, :] = raw_img
-                    # raw_img_save.flush()
-                elif len(raw_img.shape) == 3:
-                    raw_img_save[np.mod(i, N_PER_BAT_FILE), :, :, :] = raw_img
-                    # raw_img_save.flush()
-            # Intensity spectra (row 1: wavelengths; row 2: intensities; row 3: mean value used to shift spectra)
-            if runOpts.saveSpectra:
-                if i == 0:
-                    waveSave = np.ravel(wavelengths)
-                specSave[i, :] = np.ravel(intensitySpectrum)
-                meanShiftSave[i] = meanShift
-            # Oscilloscope
-            if runOpts.saveOscMeas:
-                oscOut = tasks[2].result()
-                for c in range(n_channels):
-                    if i == 0:
-                        oscSave[c][i, :] = np.ravel(oscOut[0])
-                    oscSave[c][i + 1, :] = np.ravel(oscOut[1][c]["data"])
-            # Embedded Measurements from the Arduino
-            arduinoOut = tasks[3].result()
-            prevTime = arduinoOut[0]
-            if runOpts.saveEmbMeas:
-                ArdSave[i, :] = np.ravel(arduinoOut)
+            # asynchronous measurement; each measurement is processed and saved
+            # as soon as it is completed, while the others are still running
+            async for idx, out in ameas.async_measure_as_completed(
+                arduinoPI, osc, spec, runOpts, wavelengths
+            ):
+                if idx == 0:
+                    # Temperature
+                    thermalCamMeasure = out
+                    if thermalCamMeasure is not None:
+                        Ts = thermalCamMeasure[0]
+                        Ts2 = thermalCamMeasure[1]
+                        Ts3 = thermalCamMeasure[2]
+                        raw_img = thermalCamMeasure[3]
+                    else:
+                        print(
+                            "Temperature data not collected! Thermal Camera measurements will be set to -300."
+                        )
+                        Ts = -300
+                        Ts2 = -300
+                        Ts3 = -300
+
+                    # Save measurements <--- takes on the order of 1-2e-5 seconds
+                    if runOpts.saveData:
+                        Tsave[i] = Ts
+                    if runOpts.saveSpatialTemp:
+                        Ts2save[i] = Ts2
+                        Ts3save[i] = Ts3
+                    if runOpts.saveEntireImage:
+                        # batch number and index of the image in the batch
+                        n, k = divmod(i, N_PER_BAT_FILE)
+                        if k == 0 and n > 0:
+                            # write out the finished batch and release its
+                            # pages
+                            release_memmap(raw_img_save, (n-1)*N_PER_BAT_FILE, n*N_PER_BAT_FILE)
+                        if len(raw_img.shape) == 2:
+                            raw_img_save[i, :, :] = raw_img
+                            # raw_img_save.flush()
+                        elif len(raw_img.shape) == 3:
+                            raw_img_save[i, :, :, :] = raw_img
+                            # raw_img_save.flush()
+
+                elif idx == 1:
+                    # Total intensity
+                    specOut = out
+                    if specOut is not None:
+                        totalIntensity = specOut[0]
+                        intensitySpectrum = specOut[1]
+                        wavelengths = specOut[2]
+                        meanShift = specOut[3]
+                    else:
+                        print(
+                            "Intensity data not collected! Spectrometer outputs will be set to -1."
+                        )
+                        totalIntensity = -1
+                        intensitySpectrum = -1
+                        wavelengths = -1
+                        meanShift = -1
+
+                    if runOpts.saveData:
+                        Isave[i] = totalIntensity
+                    # Intensity spectra (row 1: wavelengths; row 2: intensities; row 3: mean value used to shift spectra)
+                    # (the measurements are 1-D arrays, which are copied
+                    # directly into the rows of the saved data)
+                    if runOpts.saveSpectra:
+                        if i == 0:
+                            assert intensitySpectrum.ndim == 1 and wavelengths.ndim == 1
+                            waveSave = wavelengths
+                        specSave[i] = intensitySpectrum
+                        meanShiftSave[i] = meanShift
+
+                elif idx == 2:
+                    # Oscilloscope
+                    if runOpts.saveOscMeas:
+                        oscOut = out
+                        if i == 0:
+                            oscSave[:, i, :] = oscOut[0]
+                        oscSave[:, i + 1, :] = oscOut[1]
+
+                else:
+                    # Embedded Measurements from the Arduino
+                    arduinoOut = out
+                    prevTime = arduinoOut[0]
+                    if runOpts.saveEmbMeas:
+                        if i == 0:
+                            assert arduinoOut.ndim == 1
+                        ArdSave[i] = arduinoOut
 
             print(
                 f"Measured Outputs: Temperature: {Ts:.2f}, Intensity: {totalIntensity:.2f}\n"
             )
 
-            # Send inputs <--- takes at least 0.15 seconds (due to programmed pauses)
+            # Send inputs <--- a single write without waiting for the Arduino;
+            # lines received before the inputs are discarded so that the next
+            # embedded measurement is read after the inputs were sent. The
+            # write is skipped if the inputs are the same as the last ones sent
             # ard.sendInputsArduino(arduinoPI, power_seq[i], flow_seq[i], dutyCycle, arduinoAddress)
-            ard.sendControlledInputsArduino(
-                arduinoPI, float(power_seq[i]), float(flow_seq[i]), arduinoAddress
-            )
+            arduinoPI.reset_input_buffer()
+            if i == 0 or power_seq[i] != power_seq[i-1] or flow_seq[i] != flow_seq[i-1]:
+                ard.sendInputsArduinoNoWait(
+                    arduinoPI, float(power_seq[i]), float(flow_seq[i])
+                )
 
             # Pause for the duration of the sampling time to allow the system to evolve
-            endTime = time.time()
-            runTime = endTime - startTime
+            endTime = time.perf_counter_ns()
+            runTime = (endTime - startTime) / 1e9
             print("Total Runtime was:", runTime)
             pauseTime = runOpts.tSampling - runTime
             if pauseTime > 0:
                 print(f"Pausing for {pauseTime} seconds...")
-                time.sleep(pauseTime)
+                await asyncio.sleep(pauseTime)
             else:
                 print(
                     "WARNING: Measurement Time was greater than Sampling Time! Data may be inaccurate."
@@ -364,8 +536,11 @@ class Experiment:
         # shut off APPJ
         ard.sendInputsArduino(arduinoPI, 0.0, 0.0, 100.0, arduinoAddress)
 
-        raw_img_save = []
-        del raw_img_save  # flush memory changes
+        # write out the last batch of images (deterministically, rather than
+        # relying on the memmap being garbage collected)
+        if runOpts.saveEntireImage:
+            release_memmap(raw_img_save)
+            raw_img_save = None
 
         # create dictionary of experimental data
         exp_data = {}
@@ -390,7 +565,7 @@ class Experiment:
             specSave = []
             meanShiftSave = []
         if runOpts.collectOscMeas:
-            exp_data["oscSave"] = [o.tolist() for o in oscSave]
+            exp_data["oscSave"] = oscSave
             oscSave = []
         if runOpts.collectEmbedded:
             exp_data["ArdSave"] = ArdSave
@@ -403,27 +578,122 @@ class Experiment:
         power_seq = []
         flow_seq = []
 
-        # save experimental data dictionary as json to have a backup copy
+        # save experimental data dictionary as a backup copy and as separate
+        # files of each type of experimental data in the background; use
+        # wait_for_saves to wait for the files to be written
         self.exp_data = exp_data
-        print("\n\n\n****************************\n"+"saving JSON file of experimental data as backup ...")
-        s = time.time()
-        with open(
-            self.backupSaveDir + "OL_data_" + str(self.ol_count) + ".json", "w"
-        ) as fp:
-            json.dump(exp_data, fp, cls=CustomJSONEncoder)
-        print(f"saved JSON, took {time.time()-s} seconds")
-
-        # save separate files of each type of experimental data
-        print("\n\n\n****************************\n"+"saving segregated data files ...")
-        exp_saveDir = self.saveDir
-        if not os.path.exists(exp_saveDir):
-            os.makedirs(exp_saveDir, exist_ok=True)
-        exp_data_saver(exp_data, exp_saveDir, "OL_data_" + str(self.ol_count), runOpts)
+        self._save_futures.append(
+            self._save_pool.submit(
+                self._save_exp_data, exp_data, backup_name, runOpts
+            )
+        )
 
         self.ol_count += 1
         return self.exp_data
 
 
+def save_csv(file_name, columns, header, block_size=4096):
+    """
+    This function saves columns of data (e.g., Tsave, Isave, ...) to a csv
+    file, in the same format as np.savetxt (with delimiter="," and
+    comments=""). The columns are copied once into a (block of a) row-major
+    array and each block of rows is formatted with a single string operation,
+    rather than formatting the file row by row.
+
+    file_name is the path of the csv file
+    columns is a sequence of 1-D arrays of the same length (or a 2-D array
+            whose rows are the columns of the file)
+    header is the header line of the file
+    """
+    n_rows = len(columns[0])
+    row_fmt = ",".join(["%.18e"] * len(columns)) + "\n"
+    rows = np.empty((min(block_size, n_rows), len(columns)))
+    with open(file_name, "w") as f:
+        f.write(header + "\n")
+        for start in range(0, n_rows, block_size):
+            n = min(block_size, n_rows - start)
+            for j, column in enumerate(columns):
+                rows[:n, j] = column[start:start+n]
+            f.write((row_fmt * n) % tuple(rows[:n].ravel().tolist()))
+
+
+def exp_data_backup(exp_data, saveDir, exp_name):
+    """
+    This function saves a backup copy of the experimental data generated using
+    the Experiment class. Arrays (including lists of arrays, e.g., oscSave) are
+    written in binary as datasets of an HDF5 file, exp_name.h5, with LZF
+    compression, and numeric scalars (e.g., Niter) are also stored as
+    attributes of this file. All other entries (e.g., Niter, badTimes,
+    opt_dict) are saved to a small sidecar JSON file, exp_name_metadata.json.
+    Arrays that are already backed by a file in saveDir (e.g., the memmap of
+    the spectra) are not written again; only their file name, dtype and shape
+    are recorded in the metadata (under "backup_memmaps"). These files are
+    named per experiment (e.g., tmp_spec_data_<exp_name>.dat) and are never
+    reused, so the backup stays valid after later experiments are run.
+
+    exp_data is the dictionary of experimental data obtained by running an
+            experiment via the the Experiments class
+    saveDir is the path to the save location
+    exp_name is the name of the backup files
+    """
+    metadata = {}
+    memmaps = {}
+    with h5py.File(saveDir + exp_name + ".h5", "w") as f:
+        for key, value in exp_data.items():
+            if isinstance(value, list) and value and isinstance(value[0], (list, np.ndarray)):
+                value = np.asarray(value)
+            if (
+                isinstance(value, np.memmap)
+                and value.filename is not None
+                and os.path.dirname(value.filename) == os.path.abspath(saveDir)
+            ):
+                # the data is already on disk in the backup folder
+                value.flush()
+                memmaps[key] = {
+                    "filename": os.path.basename(value.filename),
+                    "dtype": value.dtype.str,
+                    "shape": value.shape,
+                }
+            elif isinstance(value, np.ndarray):
+                # compression requires a chunked (non-empty) dataset
+                compression = "lzf" if value.size > 0 else None
+                f.create_dataset(key, data=value, compression=compression)
+            else:
+                if isinstance(value, (int, float, np.number)):
+                    f.attrs[key] = value
+                metadata[key] = value
+    metadata["backup_memmaps"] = memmaps
+    if orjson is not None:
+        with open(saveDir + exp_name + "_metadata.json", "wb") as fp:
+            fp.write(orjson.dumps(metadata, default=json_default))
+    else:
+        with open(saveDir + exp_name + "_metadata.json", "w") as fp:
+            json.dump(metadata, fp, cls=CustomJSONEncoder)
+
+
+def exp_data_load_backup(saveDir, exp_name):
+    """
+    This function loads the backup copy of the experimental data saved by
+    exp_data_backup, and returns the dictionary of experimental data.
+
+    saveDir is the path to the save location of the backup
+    exp_name is the name of the backup files
+    """
+    with open(saveDir + exp_name + "_metadata.json", "r") as fp:
+        exp_data = json.load(fp, object_hook=json_ndarray_hook)
+    for key, info in exp_data.pop("backup_memmaps", {}).items():
+        exp_data[key] = np.memmap(
+            saveDir + info["filename"],
+            mode="r",
+            dtype=np.dtype(info["dtype"]),
+            shape=tuple(info["shape"]),
+        )
+    with h5py.File(saveDir + exp_name + ".h5", "r") as f:
+        for key in f:
+            exp_data[key] = f[key][()]
+    return exp_data
+
+
 def exp_data_saver(exp_data, saveDir, exp_name, runOpts):
     """
     This function saves experimental data generated using the Experiment class.
@@ -442,31 +712,21 @@ def exp_data_saver(exp_data, saveDir, exp_name, runOpts):
     if not os.path.exists(saveDir + exp_name):
         os.makedirs(saveDir + exp_name, exist_ok=True)
         
-    if runOpts.saveData:
+    def save_input_output_data():
         s = time.time()
         # extract data
-        Tsave = np.array(exp_data["Tsave"])
-        Isave = np.array(exp_data["Isave"])
-        Psave = np.array(exp_data["Psave"])
-        qSave = np.array(exp_data["qSave"])
+        Tsave = np.asarray(exp_data["Tsave"])
+        Isave = np.asarray(exp_data["Isave"])
+        Psave = np.asarray(exp_data["Psave"])
+        qSave = np.asarray(exp_data["qSave"])
         badTimes = exp_data["badTimes"]
 
         dataHeader = "Ts (degC),I (a.u.),P (W),q (slm)"
-        # Concetenate inputs and outputs into one numpy array to save it as a csv
-        saveArray = np.hstack(
-            (
-                Tsave.reshape(-1, 1),
-                Isave.reshape(-1, 1),
-                Psave.reshape(-1, 1),
-                qSave.reshape(-1, 1),
-            )
-        )
-        np.savetxt(
+        # save the inputs and outputs as the columns of a csv
+        save_csv(
             saveDir + exp_name + "/inputOutputData.csv",
-            saveArray,
-            delimiter=",",
-            header=dataHeader,
-            comments="",
+            [Tsave, Isave, Psave, qSave],
+            dataHeader,
         )
         if badTimes:
             np.savetxt(
@@ -474,147 +734,151 @@ def exp_data_saver(exp_data, saveDir, exp_name, runOpts):
             )
         print(f"> saved simple OL data, took {time.time()-s} seconds")
 
-    if runOpts.saveSpatialTemp:
+    def save_spatial_temp_data():
         s = time.time()
         # extract data
-        Tsave = np.array(exp_data["Tsave"])
-        Ts2save = np.array(exp_data["Ts2save"])
-        Ts3save = np.array(exp_data["Ts3save"])
+        Tsave = np.asarray(exp_data["Tsave"])
+        Ts2save = np.asarray(exp_data["Ts2save"])
+        Ts3save = np.asarray(exp_data["Ts3save"])
 
         dataHeader = "Ts (degC),Ts2 (degC),Ts3 (degC)"
-        saveArray = np.hstack(
-            (Tsave.reshape(-1, 1), Ts2save.reshape(-1, 1), Ts3save.reshape(-1, 1))
-        )
-        np.savetxt(
+        save_csv(
             saveDir + exp_name + "/dataCollectionSpatialTemps.csv",
-            saveArray,
-            delimiter=",",
-            header=dataHeader,
-            comments="",
+            [Tsave, Ts2save, Ts3save],
+            dataHeader,
         )
         print(f"> saved simple spatial temperature data, took {time.time()-s} seconds")
 
-    if runOpts.saveSpectra:
+    def save_spectra_data():
         s = time.time()
         # extract data
-        waveSave = np.array(exp_data["waveSave"])
-        specSave = np.array(exp_data["specSave"])
-        meanShiftSave = np.array(exp_data["meanShiftSave"])
+        waveSave = np.asarray(exp_data["waveSave"])
+        specSave = np.asarray(exp_data["specSave"])
+        meanShiftSave = np.asarray(exp_data["meanShiftSave"])
 
         print(
             "---> Entire spectra will be saved in a compressed .npz file with the following array variable names:\n"
             + "--->    'wavelengths' for the range of wavelength values\n"
-            + "--->    'intensities' for the full intensity spectra corresponding to the wavelength range\n"
+            + "--->    'intensities' for the full intensity spectra corresponding to the wavelength range (iteration, wavelength), stored column-major\n"
             + "--->    'meanShifts' for the mean value used to shift the spectra.\n"
             + "---> Please use a Python script and numpy.load(file_name) to load this data."
         )
+        # the intensities are stored column-major (Fortran order), so that the
+        # data of each wavelength over time, intensities[:, j], is contiguous
+        # on disk and when loaded; the shape, (iteration, wavelength), is the
+        # same as for row-major data
         np.savez_compressed(
             saveDir + exp_name + "/dataCollectionSpectra",
             wavelengths=waveSave,
-            intensities=specSave,
+            intensities=np.asfortranarray(specSave),
             meanShifts=meanShiftSave,
         )
         print(f"> saved full optical emission spectra data, took {time.time()-s} seconds")
 
-    if runOpts.saveOscMeas:
+    def save_osc_data():
         s = time.time()
         # extract data
-        oscSave_list = exp_data["oscSave"]
-        oscSave = [np.array(o) for o in oscSave_list]
+        oscSave = np.asarray(exp_data["oscSave"])
 
         print(
-            "---> Oscilloscope output will be saved in a compressed .npz file with variable names corresponding to the channel at which the data was collected:\n"
+            "---> Oscilloscope output will be saved in a compressed .npz file, dataCollectionOscilloscope.npz, with variable names corresponding to the channel at which the data was collected:\n"
             + "---> f'ch[j]' for the data collected from channel j\n"
             + "---> note that the first row corresponds to the timebase in which the data was collected."
         )
 
-        if len(oscSave) == 1:
-            np.savez_compressed(
-                saveDir + exp_name + "/dataCollectionOscilloscope",
-                chA=oscSave[0],
-            )
-        elif len(oscSave) == 2:
-            np.savez_compressed(
-                saveDir + exp_name + "/dataCollectionOscilloscope",
-                chA=oscSave[0],
-                chB=oscSave[1],
-            )
-        elif len(oscSave) == 3:
-            np.savez_compressed(
-                saveDir + exp_name + "/dataCollectionOscilloscope",
-                chA=oscSave[0],
-                chB=oscSave[1],
-                chC=oscSave[2],
-            )
-        elif len(oscSave) == 4:
-            np.savez_compressed(
-                saveDir + exp_name + "/dataCollectionOscilloscope",
-                chA=oscSave[0],
-                chB=oscSave[1],
-                chC=oscSave[2],
-                chD=oscSave[4],
-            )
-        else:
-            print("too many channels!")
+        # channels are named chA, chB, ... in the order they were collected;
+        # all channels are kept in one file (the file is written concurrently
+        # with the other types of data, see below)
+        np.savez_compressed(
+            saveDir + exp_name + "/dataCollectionOscilloscope",
+            **{f"ch{chr(65+c)}": o for c,o in enumerate(oscSave)},
+        )
 
         print(f"> saved oscilloscope data, took {time.time()-s} seconds")
 
-    if runOpts.saveEmbMeas:
+    def save_emb_data():
         s = time.time()
         # extract data
-        ArdSave = np.array(exp_data["ArdSave"])
+        ArdSave = np.asarray(exp_data["ArdSave"])
 
         dataHeader = "t_emb (ms),Isemb (a.u.),Vp2p (V),f (kHz),q (slm),x_pos (mm),y_pos (mm),dsep (mm),T_emb (K),P_emb (W),Pset (W),duty (%),V_emb (kV),I_emb (mA)"
-        np.savetxt(
+        save_csv(
             saveDir + exp_name + "/dataCollectionEmbedded.csv",
-            ArdSave,
-            delimiter=",",
-            header=dataHeader,
-            comments="",
+            ArdSave.T,
+            dataHeader,
         )
 
         print(f"> saved arduino serial output, took {time.time()-s} seconds")
 
-    if runOpts.saveEntireImage:
+    def save_image_data():
         s = time.time()
         print(
             "---> Thermal images will be saved using the HDF5 file format.\n"
-            + "---> Each file corresponds to the thermal image data collected at one iteration.\n"
+            + "---> All images are saved to a single file, thermal_images.h5, in the dataset 'images', where images[i] is the thermal image data collected at iteration i.\n"
             + "---> These files may be loaded with the h5py package and displayed with the matplotlib.pyplot or cv2 imshow() method (please search for the appropriate documentation to use these packages)."
         )
         # extract data
         raw_img_save_files = exp_data["raw_img_save_files"]
-        mmap_opts = exp_data["mmap_opts"]
+        mmap_opts = dict(exp_data["mmap_opts"])
         mmap_opts["dtype"] = DTypes[mmap_opts["dtype"]].value
         mmap_opts["shape"] = tuple(mmap_opts["shape"])
         Niter = exp_data["Niter"]
-        exp_data = []
-        del exp_data
 
-        # make directory for thermal images
-        if not os.path.exists(saveDir + exp_name + f"/thermal_images"):
-            os.makedirs(saveDir + exp_name + f"/thermal_images", exist_ok=True)
-        
-        # save hdf5 files for permanent storage option
-        for n,img_save_file in enumerate(raw_img_save_files):
-            raw_img_save = np.memmap(img_save_file, mode="r+", **mmap_opts)
-            n_images = mmap_opts["shape"][0]
-        
-            for i in range(n_images):
-                if (n*N_PER_BAT_FILE+i) <= Niter:
-                    with h5py.File(
-                        saveDir + exp_name + f"/thermal_images/iter{n*N_PER_BAT_FILE+i}.h5", "w"
-                    ) as f:
-                        dataset = f.create_dataset(
-                            "image",
-                            mmap_opts["shape"][1:],
-                            h5py.h5t.STD_U8BE,
-                            data=raw_img_save[i],
-                        )
-            del raw_img_save
+        # save a single hdf5 file for permanent storage option; the images are
+        # stored in (deflate compressed) chunks of about 1 MB, sized so that
+        # each batch is made of whole chunks. Full chunks are compressed here
+        # and written directly to the file, bypassing the HDF5 filter pipeline
+        img_shape = mmap_opts["shape"][1:]
+        img_bytes = int(np.prod(img_shape)) * np.dtype(mmap_opts["dtype"]).itemsize
+        n_max = max(1, min(N_PER_BAT_FILE, Niter, 2**20 // img_bytes))
+        n_chunk = max(d for d in range(1, n_max+1) if N_PER_BAT_FILE % d == 0)
+        with h5py.File(saveDir + exp_name + "/thermal_images.h5", "w") as f:
+            dataset = f.create_dataset(
+                "images",
+                (Niter, *img_shape),
+                h5py.h5t.STD_U8BE,
+                chunks=(n_chunk, *img_shape),
+                compression="gzip",
+                compression_opts=1,
+            )
+            zero_offset = (0,) * len(img_shape)
+            # (older data sets saved one memmap file per batch of images)
+            n_per_file = mmap_opts["shape"][0]
+            for n,img_save_file in enumerate(raw_img_save_files):
+                raw_img_save = np.memmap(img_save_file, mode="r", **mmap_opts)
+                n_images = min(n_per_file, Niter - n*n_per_file)
+                n_full = n_images - n_images % n_chunk
+                for k in range(0, n_full, n_chunk):
+                    dataset.id.write_direct_chunk(
+                        (n*n_per_file + k, *zero_offset),
+                        zlib.compress(raw_img_save[k:k+n_chunk], 1),
+                    )
+                if n_full < n_images:
+                    # partial chunk at the end of the data
+                    dataset[n*n_per_file+n_full:n*n_per_file+n_images] = raw_img_save[n_full:n_images]
+                del raw_img_save
 
         print(f"> saved thermal image data, took {time.time()-s} seconds")
 
+    # the files are written concurrently; numpy's file writes and the zlib
+    # compression release the GIL
+    savers = []
+    if runOpts.saveData:
+        savers.append(save_input_output_data)
+    if runOpts.saveSpatialTemp:
+        savers.append(save_spatial_temp_data)
+    if runOpts.saveSpectra:
+        savers.append(save_spectra_data)
+    if runOpts.saveOscMeas:
+        savers.append(save_osc_data)
+    if runOpts.saveEmbMeas:
+        savers.append(save_emb_data)
+    if runOpts.saveEntireImage:
+        savers.append(save_image_data)
+    with ThreadPoolExecutor(max_workers=max(len(savers), 1)) as executor:
+        futures = [executor.submit(saver) for saver in savers]
+    for future in futures:
+        future.result()
 
     print("\n\nData saved in the following directory:")
     print(saveDir)
@@ -17,18 +17,43 @@ Written/Modified By: Kimberly Chan
 
 from enum import Enum
 import ctypes
+import threading
+from collections import deque
 import numpy as np
 from picosdk.ps2000a import ps2000a as ps
 import matplotlib.pyplot as plt
 from picosdk.functions import adc2mV, assert_pico_ok
 import time
 
+# input ranges of the channels in mV, indexed by the PS2000A_RANGE enum (as in
+# picosdk.functions.adc2mV)
+CHANNEL_RANGES_MV = np.array([10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000])
+
 class Channel(Enum):
     CH_A = ps.PS2000A_CHANNEL['PS2000A_CHANNEL_A']
     CH_B = ps.PS2000A_CHANNEL['PS2000A_CHANNEL_B']
     CH_C = ps.PS2000A_CHANNEL['PS2000A_CHANNEL_C']
     CH_D = ps.PS2000A_CHANNEL['PS2000A_CHANNEL_D']
 
+class ChannelCfg(ctypes.Structure):
+    """
+    The class ChannelCfg holds the settings of a single oscilloscope channel as
+    a C structure, with the fields in the order of the arguments passed to
+    ps2000aSetChannel (after the device handle). An array of ChannelCfg, e.g.,
+    (ChannelCfg * 3)(...), may be passed to Oscilloscope.set_channels.
+    """
+    _fields_ = [
+        ("channel", ctypes.c_int32),
+        ("enabled", ctypes.c_int16),
+        ("coupling", ctypes.c_int32),
+        ("range", ctypes.c_int32),
+        ("offset", ctypes.c_float),
+    ]
+
+    @property
+    def name(self):
+        return Channel(self.channel).name[-1]
+
 class Oscilloscope():
     """
     The class Oscilloscope defines a custom object that is used to connect to a
@@ -49,6 +74,10 @@ class Oscilloscope():
         self.buffers_info = None
         self.channel_datas = None
         self.time_data = None
+        self.complete_buffers = None
+        self.cFuncPtr = None
+        self.channel_array = None
+        self.stream_thread = None
 
     def open_device(self):
         '''
@@ -137,74 +166,93 @@ class Oscilloscope():
         '''
         function to set the channels for data collection of the oscilloscope.
         Inputs:
-        channels        a list of dictionaries that each correspond to a
-                        dictionary of channel information/settings
+        channels        an array of ChannelCfg structures, or a list of
+                        dictionaries that each correspond to a dictionary of
+                        channel information/settings
 
         Outputs:
         status          the current status dictionary of the Oscilloscope instance
         '''
+        # resolve the channel settings into a contiguous array of C structures
+        self.channel_cfgs = (ChannelCfg * len(channels))(
+            *[channel if isinstance(channel, ChannelCfg) else self._channel_cfg_from_dict(channel) for channel in channels]
+        )
+
+        for cfg in self.channel_cfgs:
+            # set the channel connection
+            self.status[f'set_ch{cfg.name}'] = ps.ps2000aSetChannel(self.chandle,
+                                                                     cfg.channel,
+                                                                     cfg.enabled,
+                                                                     cfg.coupling,
+                                                                     cfg.range,
+                                                                     cfg.offset)
+            assert_pico_ok(self.status[f'set_ch{cfg.name}'])
+
+        self.channels_info = [{"name": cfg.name, "range": cfg.range} for cfg in self.channel_cfgs]
+        self.channel_datas = [{"name": cfg.name} for cfg in self.channel_cfgs]
+        self.channel_array = None
+        # input range (mV) of each channel, as a column to scale all channels at once
+        self.channel_ranges_mV = CHANNEL_RANGES_MV[[cfg.range for cfg in self.channel_cfgs]].reshape(-1, 1)
+        # # TODO: add return status
+        return self.status
+
+    def _channel_cfg_from_dict(self, channel):
+        '''
+        helper function to convert a dictionary of channel information/settings
+        into a ChannelCfg structure, using default settings for any that are not
+        provided
+        '''
         # set defaults in case not provided
         default_enable_status = 1
         default_coupling_type = ps.PS2000A_COUPLING['PS2000A_DC']
         default_channel_range = ps.PS2000A_RANGE['PS2000A_2V']
         default_analog_offset = 0.0
 
-        for channel in channels:
-            # construct the channel arguments from the input dictionary
-            ch_args = []
-
-            # the channel name can be provided in two ways,
-            # 1) as a single character denoting the channel, e.g., A, B, C, D
-            # 2) as the name within the Enum defined above, e.g., CH_A, CH_B, etc
-            # otherwise, throw an error
-            if len(channel['name']) == 1:
-                ch_name = f'CH_{channel["name"]}'
-                ch_args.append(Channel[ch_name].value)
-                ch_name = channel['name']
-            elif len(channel['name']) == 4:
-                ch_args.append(Channel[channel['name']].value)
-                ch_name = channel['name'][-1]
-            else:
-                print('Invalid Channel Name!')
-                raise
-
-            # add the enabled status, if not provided, use the default (defaults defined above in code)
-            if 'enable_status' in channel:
-                ch_args.append(channel['enable_status'])
-            else:
-                ch_args.append(default_enable_status)
-                print(f'No enabled status provided, using default: {default_enable_status}.')
-
-            # add the coupling type, if not provided, use the default (defaults defined above in code)
-            if 'coupling_type' in channel:
-                ch_args.append(channel['coupling_type'])
-            else:
-                ch_args.append(default_coupling_type)
-                print(f'No coupling type provided, using default: {default_coupling_type}.')
-
-            # add the range, if not provided, use the default (defaults defined above in code)
-            if 'range' in channel:
-                ch_args.append(channel['range'])
-            else:
-                ch_args.append(default_channel_range)
-                print(f'No range provided, using default: {default_channel_range}.')
-
-            # add the analog offset, if not provided, use the default (defaults defined above in code)
-            if 'analog_offset' in channel:
-                ch_args.append(channel['analog_offset'])
-            else:
-                ch_args.append(default_analog_offset)
-                print(f'No offset provided, using default: {default_analog_offset}.')
-            # print(ch_args)
+        # construct the channel arguments from the input dictionary
+        ch_args = []
+
+        # the channel name can be provided in two ways,
+        # 1) as a single character denoting the channel, e.g., A, B, C, D
+        # 2) as the name within the Enum defined above, e.g., CH_A, CH_B, etc
+        # otherwise, throw an error
+        if len(channel['name']) == 1:
+            ch_args.append(Channel[f'CH_{channel["name"]}'].value)
+        elif len(channel['name']) == 4:
+            ch_args.append(Channel[channel['name']].value)
+        else:
+            print('Invalid Channel Name!')
+            raise
 
-            # set the channel connection
-            self.status[f'set_ch{ch_name}'] = ps.ps2000aSetChannel(self.chandle, *ch_args)
-            assert_pico_ok(self.status[f'set_ch{ch_name}'])
+        # add the enabled status, if not provided, use the default (defaults defined above in code)
+        if 'enable_status' in channel:
+            ch_args.append(channel['enable_status'])
+        else:
+            ch_args.append(default_enable_status)
+            print(f'No enabled status provided, using default: {default_enable_status}.')
 
-        self.channels_info = channels
-        self.channel_datas = [{"name": channel["name"]} for channel in channels]
-        # # TODO: add return status
-        return self.status
+        # add the coupling type, if not provided, use the default (defaults defined above in code)
+        if 'coupling_type' in channel:
+            ch_args.append(channel['coupling_type'])
+        else:
+            ch_args.append(default_coupling_type)
+            print(f'No coupling type provided, using default: {default_coupling_type}.')
+
+        # add the range, if not provided, use the default (defaults defined above in code)
+        if 'range' in channel:
+            ch_args.append(channel['range'])
+        else:
+            ch_args.append(default_channel_range)
+            print(f'No range provided, using default: {default_channel_range}.')
+
+        # add the analog offset, if not provided, use the default (defaults defined above in code)
+        if 'analog_offset' in channel:
+            ch_args.append(channel['analog_offset'])
+        else:
+            ch_args.append(default_analog_offset)
+            print(f'No offset provided, using default: {default_analog_offset}.')
+        # print(ch_args)
+
+        return ChannelCfg(*ch_args)
 
     def set_data_buffers(self, buffers):
         '''
@@ -294,6 +342,7 @@ class Oscilloscope():
                 assert_pico_ok(self.status[f'setBuffer{ch_name}'])
 
             self.buffers_info = buffers
+            self.complete_buffers = None
             # # TODO: add return status
             return self.status
 
@@ -429,7 +478,12 @@ class Oscilloscope():
         print("Capturing at sample interval %s ns" % actualSampleIntervalNs)
 
         # We need a big buffer, not registered with the driver, to keep our complete capture in.
-        self.complete_buffers = [np.zeros(shape=self.total_buff_size, dtype=np.int16) for _ in range(len(self.channels_info))]
+        # These buffers (and the C callback) are created once and reused for each capture.
+        # (one row per channel)
+        if self.complete_buffers is None:
+            self.complete_buffers = np.zeros(shape=(len(self.channels_info), self.total_buff_size), dtype=np.int16)
+        else:
+            self.complete_buffers.fill(0)
         self.nextSample = 0
         self.autoStopOuter = False
         self.wasCalledBack = False
@@ -450,7 +504,8 @@ class Oscilloscope():
 
 
         # Convert the python function into a C function pointer.
-        self.cFuncPtr = ps.StreamingReadyType(streaming_callback)
+        if self.cFuncPtr is None:
+            self.cFuncPtr = ps.StreamingReadyType(streaming_callback)
         print("done initializing streaming")
 
         # Create time data
@@ -463,10 +518,10 @@ class Oscilloscope():
         N/A
         Outputs: a tuple of time and channel data
         time_data       the time vector corresponding to the data collection
-        channel_data    a list of dictionaries containing the data acquired from
-                        a particular channel; each dictionary will contain the
-                        name of the channel where data was acquired and the data
-                        itself
+        channel_data    an array (n_channels, n_samples) of the data acquired
+                        from each channel (float32, in mV), in the order of the
+                        channels set; the channel names are given in
+                        channel_datas. The array is reused by the next capture
         '''
         self.initialize_streaming()
         # Fetch data from the driver in a loop, copying it out of the registered buffers and into our complete one.
@@ -488,11 +543,9 @@ class Oscilloscope():
         assert_pico_ok(self.status["maximumValue"])
 
         # Convert ADC counts data to mV
-        for channel_info,channel_data,complete_buffer in zip(self.channels_info,self.channel_datas,self.complete_buffers):
-            assert channel_info["name"] == channel_data["name"]
-            channel_data["data"] = adc2mV(complete_buffer, channel_info["range"], maxADC)
+        self.adc_to_mV(self.complete_buffers, maxADC)
 
-        return self.time_data, self.channel_datas
+        return self.time_data, self.channel_array
 
     def collect_data_block(self):
         '''
@@ -501,10 +554,10 @@ class Oscilloscope():
         N/A
         Outputs: a tuple of time and channel data
         time_data       the time vector corresponding to the data collection
-        channel_data    a list of dictionaries containing the data acquired from
-                        a particular channel; each dictionary will contain the
-                        name of the channel where data was acquired and the data
-                        itself
+        channel_data    an array (n_channels, n_samples) of the data acquired
+                        from each channel (float32, in mV), in the order of the
+                        channels set; the channel names are given in
+                        channel_datas. The array is reused by the next capture
         '''
 
         self.status['run_block'] = ps.ps2000aRunBlock(self.chandle,
@@ -534,13 +587,113 @@ class Oscilloscope():
         assert_pico_ok(self.status['maximumValue'])
 
         # Convert ADC counts data to mV
-        for channel_info,channel_data,buffer_max in zip(self.channels_info,self.channel_datas,self.buffer_maxes):
-            assert channel_info["name"] == channel_data["name"]
-            channel_data["data"] = adc2mV(buffer_max, channel_info["range"], maxADC)
+        self.adc_to_mV(self.buffer_maxes, maxADC)
 
         self.time_data = np.linspace(0,((self.c_total_samples.value)-1)*self.timeIntervalns.value, self.c_total_samples.value)
 
-        return self.time_data, self.channel_datas
+        return self.time_data, self.channel_array
+
+    def adc_to_mV(self, adc_buffers, maxADC):
+        '''
+        function to convert the ADC counts of each channel to mV (as
+        picosdk.functions.adc2mV, but for all samples at once). The data is
+        written into a single (n_channels, n_samples) float32 array, which is
+        created once and reused for each capture; the rows of this array are
+        also the "data" of the dictionaries in channel_datas
+        '''
+        shape = (len(adc_buffers), len(adc_buffers[0]))
+        if self.channel_array is None or self.channel_array.shape != shape:
+            self.channel_array = np.empty(shape, dtype=np.float32)
+            for channel_data,row in zip(self.channel_datas,self.channel_array):
+                channel_data["data"] = row
+        if isinstance(adc_buffers, np.ndarray):
+            # all channels at once (e.g., the complete buffers of streaming mode)
+            np.multiply(adc_buffers, self.channel_ranges_mV / maxADC.value, out=self.channel_array)
+        else:
+            for channel_info,adc_buffer,row in zip(self.channels_info,adc_buffers,self.channel_array):
+                np.multiply(adc_buffer, CHANNEL_RANGES_MV[channel_info["range"]] / maxADC.value, out=row)
+        return self.channel_array
+
+    def start_streaming_thread(self, n_slots=3):
+        '''
+        function to start collecting data through streaming continuously on a
+        dedicated (daemon) thread, so that the acquisition is not held up by
+        (and does not hold up) the rest of the measurements. Each completed
+        capture is copied into the next of n_slots preallocated buffers (a ring
+        buffer); use get_streamed_data to retrieve the latest capture. While
+        the thread runs, it is the only user of the device.
+        Inputs:
+        n_slots         number of capture buffers in the ring
+        Outputs:
+        N/A
+        '''
+        if self.stream_thread is not None:
+            return
+        n_channels = len(self.channels_info)
+        self.stream_slots = np.empty((n_slots, n_channels, self.total_buff_size), dtype=np.float32)
+        self.stream_ready = deque(maxlen=n_slots)
+        self.stream_cond = threading.Condition()
+        self.stream_running = True
+        self.stream_error = None
+        self.stream_thread = threading.Thread(target=self._stream_loop, daemon=True)
+        self.stream_thread.start()
+
+    def _stream_loop(self):
+        k = 0
+        try:
+            while self.stream_running:
+                _, channel_array = self.collect_data_streaming()
+                # the slot handed out least recently is overwritten
+                self.stream_slots[k] = channel_array
+                with self.stream_cond:
+                    self.stream_ready.append(k)
+                    self.stream_cond.notify_all()
+                k = (k+1) % len(self.stream_slots)
+        except Exception as e:
+            self.stream_error = e
+        finally:
+            with self.stream_cond:
+                self.stream_running = False
+                self.stream_cond.notify_all()
+
+    def get_streamed_data(self, block=True, timeout=None):
+        '''
+        function to get the latest capture of the streaming thread (see
+        start_streaming_thread); older captures that were not retrieved are
+        discarded
+        Inputs:
+        block           whether to wait for a new capture if none is ready
+        timeout         maximum time (s) to wait, if block is True
+        Outputs: a tuple of time and channel data (as collect_data_streaming),
+        or None if no new capture is ready
+        time_data       the time vector corresponding to the data collection
+        channel_data    an array (n_channels, n_samples) of the data acquired
+                        from each channel (float32, in mV); this is a slot of
+                        the ring buffer and is overwritten after n_slots more
+                        captures, so copy it if it is kept
+        '''
+        with self.stream_cond:
+            if block:
+                self.stream_cond.wait_for(lambda: self.stream_ready or not self.stream_running, timeout)
+            if not self.stream_ready:
+                if self.stream_error is not None:
+                    raise self.stream_error
+                return None
+            k = self.stream_ready.pop()
+            self.stream_ready.clear()
+        return self.time_data, self.stream_slots[k]
+
+    def stop_streaming_thread(self):
+        '''
+        function to stop the streaming thread (see start_streaming_thread)
+        after its current capture
+        '''
+        if self.stream_thread is None:
+            return
+        with self.stream_cond:
+            self.stream_running = False
+        self.stream_thread.join()
+        self.stream_thread = None
 
     def get_time_data(self):
         '''
@@ -580,6 +733,7 @@ class Oscilloscope():
         prints and returns the status dictionary of the particular Oscilloscope
         instance
         '''
+        self.stop_streaming_thread()
         # handle = chandle
         self.status["stop"] = ps.ps2000aStop(self.chandle)
         assert_pico_ok(self.status["stop"])
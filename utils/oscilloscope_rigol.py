@@ -32,24 +32,23 @@ class Oscilloscope:
 
     # Method that records the measurements
     def measurement(self, instr):
-        # Measurement from channel 1 (voltage)
-        instr.write(":MEAS:SOUR CHAN1")
-        Vrms = float(instr.ask("MEAS:ITEM? PVRMS"))
+        # Measurements from channel 1 (voltage), channel 2 (current) and the
+        # math channel (V*I); the source of each measurement is given with the
+        # query and all three are requested in one (semicolon-chained) query
         # Vmax=float(instr.ask("MEAS:VMAX?"))
         # Vp2p = float(instr.ask("MEAS:VPP?"))
         # Freq=float(instr.ask("MEAS:FREQ?"))
         # o.Vwave=oscilloscope.ask(':WAV:DATA?')
-
-        # Measurement from channel 2 (current)
-        instr.write(":MEAS:SOUR CHAN2")
-        Irms = float(instr.ask("MEAS:ITEM? PVRMS"))
         # Imax = float(instr.ask("MEAS:VMAX?"))*1000
         # Ip2p=float(instr.ask("MEAS:VPP?"))*1000
         # o.Iwave=oscilloscope.ask(':WAV:DATA?')
-
-        # Measurement from math channel (V*I)
-        instr.write(":MEAS:SOUR MATH")
-        Pavg = float(instr.ask("MEAS:VAVG?"))
+        queries = [":MEAS:ITEM? PVRMS,CHAN1", ":MEAS:ITEM? PVRMS,CHAN2", ":MEAS:ITEM? VAVG,MATH"]
+        resp = instr.ask(";".join(queries)).strip().split(";")
+        if len(resp) == len(queries):
+            Vrms, Irms, Pavg = map(float, resp)
+        else:
+            # the chained query was not answered in full; query each item
+            Vrms, Irms, Pavg = [float(instr.ask(q)) for q in queries]
         # Prms=float(instr.ask("MEAS:ITEM? PVRMS"))
         Prms = Vrms * Irms
 
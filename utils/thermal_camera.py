@@ -10,24 +10,69 @@ import time
 import cv2
 import numpy as np
 
-try:
-    from queue import Queue
-except ImportError:
-    from Queue import Queue
+import threading
 import platform
 
-BUF_SIZE = 2
-q = Queue(BUF_SIZE)
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# ring buffer of the latest frames of the camera; the frame callback copies each
+# frame into the next slot and then publishes its sequence number, so that the
+# consumer always takes the latest frame (older frames are simply overwritten)
+N_FRAME_SLOTS = 4
+FRAMES = None  # allocated on the first frame, (N_FRAME_SLOTS, height, width)
+FRAME_ADDRS = []  # addresses of the slots of FRAMES, for copying the frames
+latest_seq = -1  # sequence number of the latest frame
+consumed_seq = -1  # sequence number of the latest frame taken by the consumer
+frame_cond = threading.Condition()  # notified when a new frame is published
+
+# size (width, height) of the thermal image that is displayed/saved
+IMG_SIZE = (640, 480)
+
+# buffers of the 8-bit image (native frame size, allocated on the first image)
+# and of the upsampled image, which are reused for every frame; the image
+# returned by getSurfaceTemperature is overwritten by the next call
+gray_buf = None
+img_buf = np.empty((IMG_SIZE[1], IMG_SIZE[0]), dtype=np.uint8)
+
+# option to upsample the saved image with OpenCL (OpenCV transparent API, e.g.,
+# on an integrated GPU); off by default since the frames are small enough that
+# the transfers to/from the device usually cost more than the upsampling
+USE_OPENCL = False
+
+# all raw (uint16) values, from which the lookup table of raw_to_8bit is built
+RAW_VALUES = np.arange(65536, dtype=np.float32)
+# the lookup table of raw_to_8bit is rebuilt every LUT_UPDATE_FRAMES frames, from
+# the (tail-clipped) min/max of the data smoothed with an exponential moving
+# average (weight LUT_ALPHA of the newest frame)
+LUT_UPDATE_FRAMES = 5
+LUT_ALPHA = 0.3
+# clipping of the range of the lookup table: the min is taken as the
+# LUT_LOW_PERCENTILE percentile of the data (cold/dead pixels and background),
+# and the max ignores only the LUT_HOT_PIXELS hottest pixels (single bad pixels),
+# so that the (small) hot spot of the jet is not saturated
+LUT_LOW_PERCENTILE = 0.5
+LUT_HOT_PIXELS = 2
+lut = None  # cached lookup table (uint8, one entry per raw value)
+lut_range = None  # smoothed (min, max) from which lut is built
+lut_count = 0  # number of frames converted
+
+# offsets (in pixels of the displayed/saved image) of the spatial temperatures
+SPATIAL_OFFSETS = (2, 12)
+
+# unit pixel offsets (x, y) to the east, west, south and north
+CARDINAL_DX = np.array([1, -1, 0, 0])
+CARDINAL_DY = np.array([0, 0, 1, -1])
 
 
 def py_frame_callback(frame, userptr):
-    array_pointer = cast(
-        frame.contents.data,
-        POINTER(c_uint16 * (frame.contents.width * frame.contents.height)),
-    )
-    data = np.frombuffer(array_pointer.contents, dtype=np.dtype(np.uint16)).reshape(
-        frame.contents.height, frame.contents.width
-    )  # no copy
+    global FRAMES, FRAME_ADDRS, latest_seq
+    frame = frame.contents
+    n_bytes = frame.data_bytes
+    if n_bytes != (2 * frame.width * frame.height):
+        return
 
     # data = np.fromiter(
     #   frame.contents.data, dtype=np.dtype(np.uint8), count=frame.contents.data_bytes
@@ -35,11 +80,43 @@ def py_frame_callback(frame, userptr):
     #   frame.contents.height, frame.contents.width, 2
     # ) # copy
 
-    if frame.contents.data_bytes != (2 * frame.contents.width * frame.contents.height):
-        return
+    if FRAMES is None or FRAMES[0].nbytes != n_bytes:
+        # (re)allocate the ring buffer, and keep the slot addresses so that no
+        # numpy attributes are looked up per frame
+        FRAMES = np.empty((N_FRAME_SLOTS, frame.height, frame.width), dtype=np.uint16)
+        FRAME_ADDRS = [FRAMES[k].ctypes.data for k in range(N_FRAME_SLOTS)]
+    # copy the frame out of the (reused) libuvc buffer straight into the next
+    # slot (no numpy array is created for the frame), and only then publish it
+    seq = latest_seq + 1
+    memmove(FRAME_ADDRS[seq % N_FRAME_SLOTS], frame.data, n_bytes)
+    with frame_cond:
+        latest_seq = seq
+        frame_cond.notify_all()
+
+
+def get_latest_frame(timeout=500):
+    """
+    function to wait for a new frame from the thermal camera and get the
+    latest one. the returned frame is a view of a slot in the ring buffer, which
+    is only overwritten after N_FRAME_SLOTS-1 newer frames, and is read-only
+
+    Inputs:
+    timeout     maximum time to wait for a new frame (s)
 
-    if not q.full():
-        q.put(data)
+    Outputs:
+    data        raw image data (uint16) of the latest frame
+    """
+    global consumed_seq
+    with frame_cond:
+        # wakes up as soon as a frame newer than the last one taken is published
+        if not frame_cond.wait_for(lambda: latest_seq > consumed_seq, timeout):
+            raise TimeoutError("No frame received from the thermal camera!")
+        consumed_seq = latest_seq
+    data = FRAMES[consumed_seq % N_FRAME_SLOTS]
+    # the raw data is shared by all of the (temperature and image) computations,
+    # so any attempt to modify it in place raises an error
+    data.flags.writeable = False
+    return data
 
 
 PTR_PY_FRAME_CALLBACK = CFUNCTYPE(None, POINTER(uvc_frame), c_void_p)(py_frame_callback)
@@ -53,10 +130,49 @@ def ktoc(val):
     return (val - 27315) / 100.0
 
 
-def raw_to_8bit(data):
-    cv2.normalize(data, data, 0, 65535, cv2.NORM_MINMAX)
-    np.right_shift(data, 8, data)
-    return cv2.cvtColor(np.uint8(data), cv2.COLOR_GRAY2RGB)
+def ktoc_arr(data, out=None):
+    """
+    function to convert an array of raw values (centikelvin) to Celsius, in
+    float32 with a single multiply and subtract over the array (see ktoc for
+    scalar values)
+    """
+    out = np.multiply(data, np.float32(0.01), out=out, dtype=np.float32)
+    out -= np.float32(273.15)
+    return out
+
+
+def raw_to_8bit(data, out=None):
+    """
+    function to scale the raw (uint16) image data to the full 8-bit range. the
+    scaling is done with a single lookup table, and the raw data is not
+    modified. the scene is stable between frames, so the lookup table is cached
+    and only rebuilt every LUT_UPDATE_FRAMES frames from the exponential moving
+    averages of the (tail-clipped) min/max of the data. the image is returned as
+    a single (grayscale) channel; apply e.g. cv2.applyColorMap if a color image
+    is needed. the image is written to out (uint8, same shape as data) if given
+    """
+    global lut, lut_range, lut_count
+    if lut_count % LUT_UPDATE_FRAMES == 0:
+        # the tails are clipped so that a few hot/dead pixels do not compress
+        # the scene into a few codes; both bounds come from one partition
+        flat = data.ravel()
+        k_min = int(flat.size * LUT_LOW_PERCENTILE / 100)
+        k_max = max(flat.size - 1 - LUT_HOT_PIXELS, k_min)
+        minVal, maxVal = np.partition(flat, (k_min, k_max))[[k_min, k_max]].astype(float)
+        if lut_range is None:
+            lut_range = (minVal, maxVal)
+        else:
+            lut_range = (
+                (1 - LUT_ALPHA) * lut_range[0] + LUT_ALPHA * minVal,
+                (1 - LUT_ALPHA) * lut_range[1] + LUT_ALPHA * maxVal,
+            )
+        minVal, maxVal = lut_range
+        scaled = (RAW_VALUES - minVal) * (255.0 / max(maxVal - minVal, 1.0))
+        np.clip(np.rint(scaled, out=scaled), 0, 255, out=scaled)
+        lut = scaled.astype(np.uint8)
+    lut_count += 1
+    # the raw values always index within the table, so no bounds check is needed
+    return np.take(lut, data, out=out, mode="clip")
 
 
 def display_temperature(img, val_k, loc, color):
@@ -206,23 +322,86 @@ def openThermalCamera():
     return dev, ctx
 
 
+if njit is not None:
+
+    @njit(cache=True, boundscheck=False)
+    def max_and_spatial_sums(data, ns):
+        """
+        function to find the max of the raw image data and the sums of the
+        values in the four cardinal directions about it (for each offset in
+        ns, clipped to the image edge) in a single scan of the data. compiled
+        with numba; see get_avg_spatial_temps for the numpy equivalent
+
+        Outputs:
+        maxX, maxY  location of the max (first occurrence, as np.argmax)
+        sums        sums (uint32) of the four values for each offset in ns
+        """
+        height, width = data.shape
+        maxVal = data[0, 0]
+        maxX = 0
+        maxY = 0
+        for y in range(height):
+            for x in range(width):
+                if data[y, x] > maxVal:
+                    maxVal = data[y, x]
+                    maxX = x
+                    maxY = y
+        sums = np.empty(ns.shape[0], dtype=np.uint32)
+        for k in range(ns.shape[0]):
+            n = ns[k]
+            sums[k] = (
+                np.uint32(data[maxY, min(maxX + n, width - 1)])
+                + np.uint32(data[maxY, max(maxX - n, 0)])
+                + np.uint32(data[min(maxY + n, height - 1), maxX])
+                + np.uint32(data[max(maxY - n, 0), maxX])
+            )
+        return maxX, maxY, sums
+
+else:
+    max_and_spatial_sums = None
+
+
 def getSurfaceTemperature(save_spatial=False, save_image=False):
-    data = q.get(True, 500)
-    data = cv2.resize(data[:, :], (640, 480))
-    minVal, maxVal, minLoc, maxLoc = cv2.minMaxLoc(data)
-    img = raw_to_8bit(data)
-    Ts_max = display_temperature(img, maxVal, maxLoc, (0, 0, 255))
-    Ts_min = display_temperature(img, minVal, minLoc, (255, 0, 0))
-
-    # get offset values of surface temperature (added 2021/03/18)
-    # TODO: add spatial measurements to return values as desired
-    # 2 pixels away
-    n_offset1 = 2
-    Ts2 = get_avg_spatial_temp(n_offset1, data, maxLoc)
-
-    # 12 pixels away
-    n_offset2 = 12
-    Ts3 = get_avg_spatial_temp(n_offset2, data, maxLoc)
+    global gray_buf
+    data = get_latest_frame()
+    # the temperatures are taken from the native frame; the upsampled image
+    # (bilinear interpolation) cannot contain a new extremum. only the max (and
+    # its location) is used, so the min is not computed
+    # the offsets of the spatial temperatures (added 2021/03/18) are given in
+    # pixels of the (upsampled) image, and are scaled to the native frame
+    scale = data.shape[1] / IMG_SIZE[0]
+    ns = np.array([max(1, round(n*scale)) for n in SPATIAL_OFFSETS])
+    if max_and_spatial_sums is not None:
+        # find the max and the spatial values in one pass over the frame
+        maxX, maxY, sums = max_and_spatial_sums(data, ns)
+        maxLoc = (int(maxX), int(maxY))
+    else:
+        idx = np.argmax(data)
+        maxY, maxX = divmod(int(idx), data.shape[1])
+        maxLoc = (maxX, maxY)
+    Ts_max = ktoc(int(data[maxY, maxX]))
+
+    # only the outputs that are requested are computed
+    if save_spatial:
+        # get offset values of surface temperature, 2 and 12 pixels away
+        if max_and_spatial_sums is not None:
+            Ts2, Ts3 = ktoc_arr(sums / 4)
+        else:
+            Ts2, Ts3 = get_avg_spatial_temps(ns, data, maxLoc)
+
+    if save_image:
+        # nearest neighbor upsampling only repeats pixels, so it commutes with
+        # the (pixel-wise) 8-bit conversion, which is then done on the smaller
+        # native frame
+        if gray_buf is None or gray_buf.shape != data.shape:
+            gray_buf = np.empty(data.shape, dtype=np.uint8)
+        img = raw_to_8bit(data, out=gray_buf)
+        if USE_OPENCL:
+            img = cv2.resize(
+                cv2.UMat(img), IMG_SIZE, interpolation=cv2.INTER_NEAREST
+            ).get()
+        else:
+            img = cv2.resize(img, IMG_SIZE, dst=img_buf, interpolation=cv2.INTER_NEAREST)
 
     if save_spatial and save_image:
         return Ts_max, (Ts2, Ts3), img
@@ -234,48 +413,47 @@ def getSurfaceTemperature(save_spatial=False, save_image=False):
         return Ts_max
 
 
-def get_avg_spatial_temp(n_pix, data, loc):
+def get_avg_spatial_temps(ns, data, loc):
     """
-    function to get the average temperature about a certain radius of the
-    surface temperature. function gets the values from the four cardinal
-    directions and returns the average value of those four values. while the
-    function accounts for data out of the image bounds, the best practice is to
-    make sure the measured area is near the center of the captured image
+    function to get the average temperatures about certain radii of the
+    surface temperature. for each radius, the function gets the values from the
+    four cardinal directions and returns the average value of those four values.
+    the values of all radii are read from the image at once. while the function
+    accounts for data out of the image bounds (clipped to the image edge), the
+    best practice is to make sure the measured area is near the center of the
+    captured image
 
     Inputs:
-    n_pix        number of pixels offset from the surface temperature measurement
+    ns          numbers of pixels offset from the surface temperature measurement
     data        raw image data
-    loc            location of the surface temperature measurement
+    loc         location of the surface temperature measurement
 
     Outputs:
-    avg_temp    average value of the temperature from measurements in the four
-                cardinal directions
+    avg_temps   average values of the temperature from measurements in the four
+                cardinal directions, one for each number of pixels in ns
     """
     # extract the x and y values from the location
     maxX, maxY = loc
-    # east
-    if maxX + n_pix >= 640:
-        maxValE = ktoc(data[maxY, maxX])
-    else:
-        maxValE = ktoc(data[maxY, maxX + n_pix])
-    # west
-    if maxX - n_pix < 0:
-        maxValW = ktoc(data[maxY, maxX])
-    else:
-        maxValW = ktoc(data[maxY, maxX - n_pix])
-    # south
-    if maxY + n_pix >= 480:
-        maxValS = ktoc(data[maxY, maxX])
-    else:
-        maxValS = ktoc(data[maxY + n_pix, maxX])
-    # north
-    if maxY - n_pix < 0:
-        maxValN = ktoc(data[maxY, maxY])
-    else:
-        maxValN = ktoc(data[maxY - n_pix, maxX])
+    # pixels in the four cardinal directions (east, west, south, north) for each
+    # offset (one row per offset); directions that fall outside of the image are
+    # clipped to its edge
+    height, width = data.shape
+    ns = np.asarray(ns)[:, None]
+    x = np.clip(maxX + ns*CARDINAL_DX, 0, width - 1)
+    y = np.clip(maxY + ns*CARDINAL_DY, 0, height - 1)
+
+    # the conversion is linear, so it is applied once to the means of the raw
+    # values
+    avg_temps = ktoc_arr(data[y, x].sum(axis=1, dtype=np.uint32) / 4)
+    return avg_temps
+
 
-    avg_temp = (maxValE + maxValW + maxValN + maxValS) / 4
-    return avg_temp
+def get_avg_spatial_temp(n_pix, data, loc):
+    """
+    function to get the average temperature about a certain radius of the
+    surface temperature (see get_avg_spatial_temps)
+    """
+    return get_avg_spatial_temps((n_pix,), data, loc)[0]
 
 
 def closeThermalCamera(dev, ctx):